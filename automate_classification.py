@@ -1,24 +1,31 @@
 # automate_classification
 # This should be agnostic to changes inside features and techniques:
-import sqlite3
-import json
+import orjson
 import argparse
 import time
 import os
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
 import queue
 import threading
 import signal
+import itertools
+import hashlib
 
 import globals  #globals.py for global settings and variables used by multiple files.
 
-# Using a simple boolean guarded by a lock for absolute immediacy
-shutdown_lock = threading.Lock()
-shutdown_flag = False
+PROGRESS_REPORT_INTERVAL = 10 # Print progress every N papers
 
-def build_prompt(paper_data, template_content):
-    """Builds the prompt string for a single paper using a loaded template."""
+# Columns read by build_prompt; the producer streams only these to the workers
+PROMPT_COLUMNS = "id, title, abstract, keywords, authors, year, type, journal"
+
+# Duplicate entries (reprints, double imports) yield identical prompts: reuse the first LLM answer.
+# Keyed on a BLAKE2b digest of the prompt; cleared at the start of each run.
+_prompt_cache = {}
+_prompt_cache_lock = threading.Lock()
+
+def build_prompt(paper_data, template_parts):
+    """Builds the prompt string for a single paper using a template split by globals.split_prompt_template."""
+    prefix, tail_template = template_parts
     format_data = {
         'title': paper_data.get('title', ''),
         'abstract': paper_data.get('abstract', ''),
@@ -29,81 +36,98 @@ def build_prompt(paper_data, template_content):
         'journal': paper_data.get('journal', ''),
     }
     try:
-        return template_content.format(**format_data)
+        return prefix + tail_template.format(**format_data)
     except KeyError as e:
         print(f"Error formatting prompt: Missing key {e} in paper data or template expects it.")
         raise
 
-def update_paper_from_llm(db_path, paper_id, llm_data, changed_by="LLM", reasoning_trace=None):
-    """Updates paper classification fields in the database based on LLM output."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    changed_timestamp = datetime.utcnow().isoformat() + 'Z'
-    update_fields = []
-    update_values = []
-    
+MAIN_BOOL_FIELDS = ('is_survey', 'is_offtopic', 'is_through_hole', 'is_smt', 'is_x_ray')
+# Columns the LLM may or may not return; absent ones keep their current value
+LLM_OPTIONAL_FIELDS = MAIN_BOOL_FIELDS + ('research_area', 'relevance', 'features', 'technique', 'reasoning_trace')
+
+# JSON columns are merged in SQL with json_patch instead of a read-modify-write in Python.
+# Note that a null in the patch removes the key, which readers treat the same as null.
+LLM_JSON_FIELDS = ('features', 'technique')
+
+def _llm_update_expression(field):
+    """SQL expression for one optional column: the new value only when the field was provided."""
+    if field in LLM_JSON_FIELDS:
+        return f"{field} = IIF(:set_{field}, json_patch(COALESCE({field}, '{{}}'), :{field}), {field})"
+    return f"{field} = IIF(:set_{field}, :{field}, {field})"
+
+# One fixed statement for every paper so SQLite parses and plans it only once.
+# IIF(:set_x, :x, x) writes :x (which may be NULL) only when the field was provided.
+# The 'changed' timestamp is computed by SQLite itself, as ISO 8601 UTC with milliseconds.
+LLM_UPDATE_QUERY = (
+    "UPDATE papers SET "
+    + ", ".join(_llm_update_expression(field) for field in LLM_OPTIONAL_FIELDS)
+    + ", changed = strftime('%Y-%m-%dT%H:%M:%fZ', 'now'), changed_by = :changed_by WHERE id = :id"
+)
+
+def llm_update_params(paper_id, llm_data, changed_by="LLM", reasoning_trace=None):
+    """Builds the named parameters of LLM_UPDATE_QUERY for one paper's LLM classification."""
+    params = {'id': paper_id, 'changed_by': changed_by}
+    for field in LLM_OPTIONAL_FIELDS:
+        params[f"set_{field}"] = 0
+        params[field] = None
+
+    def set_field(field, value):
+        params[f"set_{field}"] = 1
+        params[field] = value
+
     if reasoning_trace is not None:
-        update_fields.append("reasoning_trace = ?")
-        update_values.append(reasoning_trace)
+        set_field('reasoning_trace', reasoning_trace)
 
     # Main Boolean Fields
-    main_bool_fields = ['is_survey', 'is_offtopic', 'is_through_hole', 'is_smt', 'is_x_ray']
-    for field in main_bool_fields:
+    for field in MAIN_BOOL_FIELDS:
         if field in llm_data:
             value = llm_data[field]
-            update_fields.append(f"{field} = ?")
-            update_values.append(1 if value is True else 0 if value is False else None)
+            set_field(field, 1 if value is True else 0 if value is False else None)
 
     # Research Area and Relevance
     if 'research_area' in llm_data:
-        update_fields.append("research_area = ?")
-        update_values.append(llm_data['research_area'])
-
-    if 'relevance' in llm_data:  # Add this line
-        update_fields.append("relevance = ?")
-        update_values.append(llm_data['relevance'])
-
-    # Features
-    cursor.execute("SELECT features FROM papers WHERE id = ?", (paper_id,))
-    row = cursor.fetchone()
-    current_features = json.loads(row[0]) if row and row[0] else {}
-    if 'features' in llm_data and isinstance(llm_data['features'], dict):
-        current_features.update(llm_data['features'])
-        update_fields.append("features = ?")
-        update_values.append(json.dumps(current_features))
-    
-    # Techniques
-    cursor.execute("SELECT technique FROM papers WHERE id = ?", (paper_id,))
-    row = cursor.fetchone()
-    current_technique = json.loads(row[0]) if row and row[0] else {}
-    if 'technique' in llm_data and isinstance(llm_data['technique'], dict):
-        current_technique.update(llm_data['technique'])
-        update_fields.append("technique = ?")
-        update_values.append(json.dumps(current_technique))
-    
-    # Audit fields
-    update_fields.append("changed = ?")
-    update_values.append(changed_timestamp)
-    update_fields.append("changed_by = ?")
-    update_values.append(changed_by)
-    
-    if update_fields:
-        update_query = f"UPDATE papers SET {', '.join(update_fields)} WHERE id = ?"
-        update_values.append(paper_id)
-        cursor.execute(update_query, update_values)
-        conn.commit()
-        rows_affected = cursor.rowcount
-    else:
-        rows_affected = 0
-    conn.close()
-    return rows_affected > 0
-
-def process_paper_worker(db_path, grammar_content, prompt_template_content, paper_id_queue, progress_lock, processed_count, total_papers, model_alias):
+        set_field('research_area', llm_data['research_area'])
+    if 'relevance' in llm_data:
+        set_field('relevance', llm_data['relevance'])
+
+    # Features and techniques: only the LLM's keys are sent, SQLite merges them into the stored JSON
+    for field in LLM_JSON_FIELDS:
+        if field in llm_data and isinstance(llm_data[field], dict):
+            set_field(field, orjson.dumps(llm_data[field]).decode())
+
+    return params
+
+def db_writer_worker(db_path, results_queue):
+    """
+    Single writer thread: drains classification results and commits them in batches
+    of up to globals.DB_WRITE_BATCH_SIZE papers per transaction. Stops on a None sentinel.
+    """
+    try:
+        conn = globals.get_db_connection(db_path)
+        for batch in globals.iter_result_batches(results_queue):
+            try:
+                rows = [llm_update_params(*result) for result in batch]
+                updated_count = globals.execute_batch(conn, LLM_UPDATE_QUERY, rows)
+            except Exception as e:
+                print(f"[DB Writer] Error writing batch of {len(batch)} papers: {e}")
+                continue
+            for paper_id, _, model_name_used, _ in batch:
+                print(f"[DB Writer] Updated paper {paper_id} (Model: {model_name_used})")
+            if updated_count < len(batch):
+                # Only possible if papers were deleted while the run was in progress
+                print(f"[DB Writer] Warning: {len(batch) - updated_count} of {len(batch)} papers in batch were not found")
+    except Exception as e:
+        # Nothing more can be saved (e.g. the database could not be opened), so stop the run
+        # instead of leaving workers to fill the queue
+        print(f"[DB Writer] Stopped: {e}")
+        globals.set_shutdown_flag()
+
+def process_paper_worker(grammar_content, prompt_template_parts, paper_queue, results_queue, processed_counter, total_papers, model_alias):
     """Worker function executed by each thread."""
     while True:
         try:
             # Use timeout to periodically check for shutdown
-            paper_id = paper_id_queue.get(timeout=1)
+            paper_data = paper_queue.get(timeout=1)
         except queue.Empty:
             # Check if we should shutdown periodically
             if globals.is_shutdown_flag_set():
@@ -111,61 +135,56 @@ def process_paper_worker(db_path, grammar_content, prompt_template_content, pape
             continue
 
         # Poison pill - time to die
-        if paper_id is None:
+        if paper_data is None:
             return
 
         # Check for shutdown before processing
         if globals.is_shutdown_flag_set():
             return
 
+        paper_id = paper_data['id']
         print(f"[Thread-{threading.get_ident()}] Processing paper ID: {paper_id}")
         
         try:
-            paper_data = globals.get_paper_by_id(db_path, paper_id)
-            if not paper_data:
-                print(f"[Thread-{threading.get_ident()}] Error: Paper {paper_id} not found in DB.")
-                continue
-                
-            prompt_text = build_prompt(paper_data, prompt_template_content)
+            prompt_text = build_prompt(paper_data, prompt_template_parts)
             if globals.is_shutdown_flag_set():
                 return
                 
-            json_result_str, model_name_used, reasoning_trace = globals.send_prompt_to_llm(
-                prompt_text, 
-                grammar_text=grammar_content, 
-                server_url_base=globals.LLM_SERVER_URL, 
-                model_name=model_alias,
-                is_verification=False
-            )
+            cache_key = hashlib.blake2b(prompt_text.encode('utf-8'), digest_size=16).digest()
+            with _prompt_cache_lock:
+                cached = _prompt_cache.get(cache_key)
+            if cached:
+                print(f"[Thread-{threading.get_ident()}] Reusing LLM answer for duplicate paper {paper_id}")
+                json_result_str, model_name_used, reasoning_trace = cached
+            else:
+                json_result_str, model_name_used, reasoning_trace = globals.send_prompt_to_llm(
+                    prompt_text, 
+                    grammar_text=grammar_content, 
+                    server_url_base=globals.LLM_SERVER_URL, 
+                    model_name=model_alias,
+                    is_verification=False
+                )
+                if json_result_str:
+                    with _prompt_cache_lock:
+                        _prompt_cache[cache_key] = (json_result_str, model_name_used, reasoning_trace)
             
             if globals.is_shutdown_flag_set():
                 return
                 
             if json_result_str:
                 try:
-                    llm_classification = json.loads(json_result_str)
+                    llm_classification = orjson.loads(json_result_str)
                     # Prepend model info to reasoning_trace
                     if reasoning_trace:
                         reasoning_trace = f"As classified by {model_name_used}\n\n{reasoning_trace}"
                     else:
                         reasoning_trace = f"As classified by {model_name_used}"
 
-                    success = update_paper_from_llm(
-                        db_path, 
-                        paper_id, 
-                        llm_classification, 
-                        changed_by=model_name_used,
-                        reasoning_trace=reasoning_trace
-                    )
-                    if success:
-                        print(f"[Thread-{threading.get_ident()}] Updated paper {paper_id} (Model: {model_name_used})")
-                    else:
-                        print(f"[Thread-{threading.get_ident()}] No changes for paper {paper_id}")
-                except json.JSONDecodeError as e:
+                    # Hand the result to the DB writer thread, which commits in batches
+                    globals.put_result(results_queue, (paper_id, llm_classification, model_name_used, reasoning_trace))
+                except orjson.JSONDecodeError as e:
                     print(f"[Thread-{threading.get_ident()}] Error parsing LLM output for {paper_id}: {e}")
                     print(f"LLM Output: {json_result_str}")
-                except Exception as e:
-                    print(f"[Thread-{threading.get_ident()}] Error updating DB for {paper_id}: {e}")
             else:
                 if not globals.is_shutdown_flag_set():
                     print(f"[Thread-{threading.get_ident()}] No LLM response for {paper_id}")
@@ -175,9 +194,10 @@ def process_paper_worker(db_path, grammar_content, prompt_template_content, pape
         finally:
             if globals.is_shutdown_flag_set():
                 return
-            with progress_lock:
-                processed_count[0] += 1
-                print(f"[Progress] Processed {processed_count[0]}/{total_papers} papers.")
+            # next() on itertools.count is atomic under the GIL, so no lock is needed
+            n = next(processed_counter)
+            if n % PROGRESS_REPORT_INTERVAL == 0 or n == total_papers:
+                print(f"[Progress] Processed {n}/{total_papers} papers.")
 
 def run_classification(mode='remaining', paper_id=None, db_file=None, grammar_file=None, prompt_template=None, server_url=None):
     """
@@ -207,6 +227,8 @@ def run_classification(mode='remaining', paper_id=None, db_file=None, grammar_fi
 
     try:
         prompt_template_content = globals.load_prompt_template(prompt_template)
+        # The instruction block is identical for every paper; unescape it only once
+        prompt_template_parts = globals.split_prompt_template(prompt_template_content)
         print(f"Loaded prompt template from '{prompt_template}'")
     except Exception as e:
         print(f"Failed to load prompt template: {e}")
@@ -229,12 +251,13 @@ def run_classification(mode='remaining', paper_id=None, db_file=None, grammar_fi
 
     print(f"Connecting to database '{db_file}'...")
     try:
-        conn = sqlite3.connect(db_file)
+        conn = globals.open_db(db_file)
+        globals.ensure_indexes(conn) # Databases created before the index existed
         cursor = conn.cursor()
         
         if mode == 'all':
             print("Fetching ALL papers for re-classification...")
-            cursor.execute("SELECT id FROM papers")
+            paper_query, paper_params = f"SELECT {PROMPT_COLUMNS} FROM papers", ()
         elif mode == 'id':
             if paper_id is None:
                 print("Error: Mode 'id' requires a specific paper ID.")
@@ -246,37 +269,47 @@ def run_classification(mode='remaining', paper_id=None, db_file=None, grammar_fi
                  print(f"Warning: Paper ID {paper_id} not found in the database.")
                  conn.close()
                  return True
-            cursor.execute("SELECT id FROM papers WHERE id = ?", (paper_id,))
+            paper_query, paper_params = f"SELECT {PROMPT_COLUMNS} FROM papers WHERE id = ?", (paper_id,)
         else: # Default to 'remaining'
             print("Fetching unprocessed papers (changed_by IS NULL or blank)...")
-            cursor.execute("SELECT id FROM papers WHERE changed_by IS NULL OR changed_by = ''")
-            
-        paper_ids = [row[0] for row in cursor.fetchall()]
+            paper_query, paper_params = f"SELECT {PROMPT_COLUMNS} FROM papers WHERE changed_by IS NULL OR changed_by = ''", ()
+
+        # Only count here; the rows themselves are streamed to the workers by globals.paper_producer
+        cursor.execute(f"SELECT COUNT(*) FROM ({paper_query})", paper_params)
+        total_papers = cursor.fetchone()[0]
         conn.close()
-        total_papers = len(paper_ids)
         print(f"Found {total_papers} paper(s) to process based on mode '{mode}'.")
 
-        if not paper_ids:
+        if not total_papers:
             print("No papers found matching the criteria. Nothing to process.")
             return True
 
-        paper_id_queue = queue.Queue()
-        for pid in paper_ids:
-            paper_id_queue.put(pid)
-
-        # Add poison pills for each worker thread
-        for _ in range(globals.MAX_CONCURRENT_WORKERS):
-            paper_id_queue.put(None)
-
     except Exception as e:
         print(f"Error fetching paper IDs: {e}")
         return False
 
-    progress_lock = threading.Lock()
-    processed_count = [0]
+    # Bounded, so the producer stays only a few papers ahead of the workers
+    paper_queue = queue.Queue(maxsize=globals.MAX_CONCURRENT_WORKERS * 4)
+    producer = threading.Thread(
+        target=globals.paper_producer,
+        args=(db_file, paper_query + globals.LONGEST_FIRST_ORDER, paper_params, paper_queue, globals.MAX_CONCURRENT_WORKERS),
+        daemon=True
+    )
+
+    processed_counter = itertools.count(1)
+    _prompt_cache.clear() # Model, grammar or template may differ from a previous run
+
+    # Results are written by a single thread so workers never contend for the write lock
+    results_queue = queue.Queue(maxsize=256)
+    db_writer = threading.Thread(target=db_writer_worker, args=(db_file, results_queue), daemon=True)
+    db_writer.start()
+
+    # Seed the HTTP connection pool before the first wave of requests
+    globals.prewarm_connections(server_url)
 
     print(f"Starting ThreadPoolExecutor with {globals.MAX_CONCURRENT_WORKERS} workers...")
     start_time = time.time()
+    producer.start()
     
     try:
         with ThreadPoolExecutor(max_workers=globals.MAX_CONCURRENT_WORKERS) as executor:
@@ -285,12 +318,11 @@ def run_classification(mode='remaining', paper_id=None, db_file=None, grammar_fi
             for _ in range(globals.MAX_CONCURRENT_WORKERS):
                 future = executor.submit(
                     process_paper_worker,
-                    db_file,
                     grammar_content,
-                    prompt_template_content,
-                    paper_id_queue,
-                    progress_lock,
-                    processed_count,
+                    prompt_template_parts,
+                    paper_queue,
+                    results_queue,
+                    processed_counter,
                     total_papers,
                     model_alias
                 )
@@ -298,10 +330,13 @@ def run_classification(mode='remaining', paper_id=None, db_file=None, grammar_fi
             
             print("Processing started. Press Ctrl+C to abort.")
             
-            while not globals.is_shutdown_flag_set():
-                if all(f.done() for f in futures):
-                    break
-                time.sleep(0.1)
+            # Block until every worker returns. The timeout only lets the main thread run
+            # signal_handler on Ctrl+C: on Windows a blocking wait defers signals until it returns.
+            while wait(futures, timeout=1).not_done:
+                pass
+            # Workers handle per-paper errors themselves; re-raise anything that escaped one
+            for future in futures:
+                future.result()
             
             if globals.is_shutdown_flag_set():
                 print("\nShutdown signal received. Waiting for threads to finish...")
@@ -313,11 +348,13 @@ def run_classification(mode='remaining', paper_id=None, db_file=None, grammar_fi
         print(f"Error in main execution loop: {e}")
         globals.set_shutdown_flag()
     finally:
+        # Flush whatever the writer still holds before reporting (skipped if the writer already died)
+        if not globals.put_result(results_queue, None, db_writer):
+            print("DB writer stopped early; some results were not saved.")
+        db_writer.join()
         end_time = time.time()
-        final_count = 0
-        if progress_lock:
-            with progress_lock:
-                final_count = processed_count[0] if processed_count else 0
+        # Workers are done, so the next value is one past the number processed
+        final_count = next(processed_counter) - 1
         print(f"\n--- Classification Summary ---")
         print(f"Papers processed: {final_count}/{total_papers}")
         print(f"Time taken: {end_time - start_time:.2f} seconds")
@@ -354,9 +391,6 @@ if __name__ == "__main__":
         server_url=args.server_url
     )
 
-    # Exit code is less critical now as signal_handler does os._exit(1)
-    # But good practice to indicate success/failure for non-abort cases
-    if not success and not globals.is_shutdown_flag_set():
-        exit(1) 
-    # If shutdown_flag is set, signal_handler already called os._exit(1)
-    # Normal exit code 0 is implicit
+    # Failed or aborted with Ctrl+C; normal exit code 0 is implicit
+    if not success:
+        exit(1)
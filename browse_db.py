@@ -1,16 +1,24 @@
 # browse_db.py
 import sqlite3
-import json
+import re
+import orjson
 import argparse
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, make_response
+from flask.templating import Environment as FlaskEnvironment
+from flask.json.provider import DefaultJSONProvider
 from markupsafe import Markup 
+from jinja2 import FileSystemBytecodeCache
 import argparse
 import tempfile
+import shutil
+import uuid
 import os
 import sys
 import threading
+import time
 import webbrowser
+import functools
 from collections import Counter
 
 # Import globals, the classification and verification modules
@@ -23,42 +31,125 @@ DEFAULT_YEAR_FROM = 2020
 DEFAULT_YEAR_TO = 2025
 DEFAULT_MIN_PAGE_COUNT = 4
 
+class DictFirstEnvironment(FlaskEnvironment):
+    """Jinja environment resolving `obj.attr` on plain dicts as a key lookup first.
+       The templates read every row (and its features/technique) as paper.field; the default
+       order tries getattr first, so each cell raised and caught an AttributeError."""
+    def getattr(self, obj, attribute):
+        if type(obj) is dict:
+            try:
+                return obj[attribute]
+            except KeyError:
+                pass # Not a key: fall back to attributes, e.g. dict methods like .get
+        return super().getattr(obj, attribute)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider for jsonify/get_json backed by orjson; types orjson lacks go through Flask's default()."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.jinja_environment = DictFirstEnvironment # Must be set before app.jinja_env is first used
+app.json = OrjsonProvider(app)
+# Compiled templates persist across restarts in a per-user temp directory; sources are checksummed, so edits still apply
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
 DATABASE = None # Will be set from command line argument
+SEARCH_INDEX_AVAILABLE = False # Set at startup once the indexes are ensured
 
 # --- Helper Functions ---
 
+# Idle request connections. The dev server runs every request on a new thread, so connections are
+# pooled rather than kept per thread; reusing them keeps their page and statement caches warm.
+_idle_connections = []
+_idle_connections_lock = threading.Lock()
+
 def get_db_connection():
-    """Create a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # Allows accessing columns by name
+    """Returns the current request's connection to the database, taking an idle one or opening one on first use.
+       Handed back by release_db_connection when the request ends."""
+    conn = getattr(g, '_db', None)
+    if conn is None:
+        with _idle_connections_lock:
+            conn = _idle_connections.pop() if _idle_connections else None
+        if conn is None:
+            conn = globals.open_db(DATABASE) # WAL, synchronous=NORMAL, in-memory temp tables
+            conn.row_factory = sqlite3.Row  # Allows accessing columns by name
+        g._db = conn
     return conn
 
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """Returns the request's database connection, if one was taken, to the idle pool."""
+    conn = g.pop('_db', None)
+    if conn is not None:
+        if conn.in_transaction:
+            conn.rollback() # Never hand a half-finished transaction to the next request
+        with _idle_connections_lock:
+            _idle_connections.append(conn)
+
+# Leading YYYY-MM-DDTHH:MM:SS of the stored ISO timestamps; fractions and the 'Z' suffix are ignored
+CHANGED_TIMESTAMP_RE = re.compile(r'(\d{2})(\d{2})-(\d{2})-(\d{2})[T ](\d{2}:\d{2}:\d{2})')
+
 def format_changed_timestamp(changed_str):
     """Format the ISO timestamp string to dd/mm/yy hh:mm:ss"""
     if not changed_str:
         return ""
-    try:
-        dt = datetime.fromisoformat(changed_str.replace('Z', '+00:00'))
-        return dt.strftime("%d/%m/%y %H:%M:%S")
-    except ValueError:
+    # Plain reordering of the captured fields, no datetime parsing per row
+    match = CHANGED_TIMESTAMP_RE.match(changed_str)
+    if match is None:
         # If parsing fails, return the original string or a placeholder
         return changed_str
+    return f"{match[4]}/{match[3]}/{match[2]} {match[5]}"
 
-def truncate_authors(authors_str, max_authors=2):
-    """Truncate the authors list for the main table view."""
-    if not authors_str:
-        return ""
-    authors_list = [a.strip() for a in authors_str.split(';')]
-    if len(authors_list) > max_authors:
-        return "; ".join(authors_list[:max_authors]) + " et al."
-    else:
-        return authors_str
-
-def fetch_papers(hide_offtopic=True, year_from=None, year_to=None, min_page_count=None, search_query=None):
-    """Fetch papers from the database, applying various optional filters."""
+def safe_int(value, default=None):
+    """Parses an integer request parameter, returning default when it is missing or invalid."""
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return default
+
+# Three-state feature/technique keys that can be filtered on, per JSON column
+JSON_FILTER_KEYS = {
+    'features': [key for key in globals.DEFAULT_FEATURES if key != 'other'],
+    'technique': [key for key in globals.DEFAULT_TECHNIQUE if key != 'model']
+}
+
+# The papers_fts columns concatenated into one string, for searches the index can't serve
+SEARCH_HAYSTACK = " || char(31) || ".join(f"COALESCE({col}, '')" for col in globals.SEARCH_COLUMNS)
+
+def parse_json_filters(args):
+    """Collects features_<key>/technique_<key> filters ('true', 'false' or 'unknown') from request args."""
+    json_filters = {}
+    for column, keys in JSON_FILTER_KEYS.items():
+        for key in keys:
+            value = args.get(f"{column}_{key}")
+            if value in ('true', 'false', 'unknown'):
+                json_filters[(column, key)] = {'true': True, 'false': False, 'unknown': None}[value]
+    return json_filters
+
+# Columns read by papers_table.html; the list view skips the large abstract and trace columns
+TABLE_COLUMNS = (
+    'id', 'type', 'title', 'doi', 'year', 'journal', 'page_count', 'is_offtopic', 'relevance',
+    'is_survey', 'is_through_hole', 'is_smt', 'is_x_ray', 'features', 'technique',
+    'changed', 'changed_by', 'verified', 'estimated_score', 'verified_by'
+)
+# Columns read by detail_row.html
+DETAIL_COLUMNS = (
+    'id', 'type', 'year', 'doi', 'issn', 'pages', 'page_count', 'authors', 'keywords', 'abstract',
+    'research_area', 'relevance', 'features', 'technique', 'user_trace', 'reasoning_trace', 'verifier_trace'
+)
+# Columns read by the /get_stats counters
+STATS_COLUMNS = ('journal', 'keywords', 'authors', 'research_area')
+
+def fetch_papers(hide_offtopic=True, year_from=None, year_to=None, min_page_count=None, search_query=None, json_filters=None, columns=None):
+    """Fetch papers from the database, applying various optional filters.
+       `columns` limits the projection to what the caller renders (default: every column).
+       Yields rows as they are read, so a streamed render never holds the whole result."""
     conn = get_db_connection()
-    query = "SELECT * FROM papers"
+    select_list = ", ".join(f"papers.{col}" for col in columns) if columns else "papers.*"
+    query = f"SELECT {select_list} FROM papers"
     conditions = []
     params = []
 
@@ -66,315 +157,185 @@ def fetch_papers(hide_offtopic=True, year_from=None, year_to=None, min_page_coun
     if hide_offtopic:
         conditions.append("(is_offtopic = 0 OR is_offtopic IS NULL)")
 
+    # Callers pass ints already; anything unparseable just drops the filter
+    year_from, year_to, min_page_count = safe_int(year_from), safe_int(year_to), safe_int(min_page_count)
     if year_from is not None:
-        try:
-            year_from = int(year_from)
-            conditions.append("year >= ?")
-            params.append(year_from)
-        except (ValueError, TypeError):
-            pass
+        conditions.append("year >= ?")
+        params.append(year_from)
 
     if year_to is not None:
-        try:
-            year_to = int(year_to)
-            conditions.append("year <= ?")
-            params.append(year_to)
-        except (ValueError, TypeError):
-            pass
+        conditions.append("year <= ?")
+        params.append(year_to)
 
     if min_page_count is not None:
-        try:
-            min_page_count = int(min_page_count)
-            conditions.append("(page_count IS NULL OR page_count = '' OR page_count > ?)")
-            params.append(min_page_count)
-        except (ValueError, TypeError):
-            pass
+        conditions.append("(page_count IS NULL OR page_count = '' OR page_count > ?)")
+        params.append(min_page_count)
+
+    # --- Feature/technique filters: json_extract expressions matching the idx_features_* indexes ---
+    for (column, key), value in (json_filters or {}).items():
+        if key not in JSON_FILTER_KEYS.get(column, ()):
+            continue # Keys are interpolated into the JSON path, so only known ones get through
+        if value is None:
+            conditions.append(f"json_extract({column}, '$.{key}') IS NULL")
+        else:
+            conditions.append(f"json_extract({column}, '$.{key}') = ?")
+            params.append(1 if value else 0)
 
     # --- NEW: Search Filter ---
-    if search_query:
-        # Define the columns to search (exclude reasoning_trace, verifier_trace, features, technique as they need special handling or are JSON)
-        searchable_columns = [
-            'id', 'type', 'title', 'authors', 'month', 'journal',
-            'volume', 'pages', 'doi', 'issn', 'abstract', 'keywords',
-            'research_area', 'user_trace' # Include user_trace in search
-        ]
-        # Create a list of LIKE conditions for each searchable column
-        search_conditions = []
-        # Add wildcard to the search term for partial matching
-        search_term_like = f"%{search_query}%"
-        for col in searchable_columns:
-            search_conditions.append(f"LOWER({col}) LIKE LOWER(?)")
-            params.append(search_term_like)
-
-        # Handle JSON columns (features, technique) - search within the JSON text representation
-        # Note: This is a basic text search within the JSON string. For complex JSON queries, consider using SQLite's JSON1 extension.
-        json_search_term = search_term_like # Use the same search term
-        json_conditions = []
-        for json_col in ['features', 'technique']:
-             # Search within the JSON string representation
-             json_conditions.append(f"LOWER({json_col}) LIKE LOWER(?)")
-             params.append(json_search_term)
-
-        # Combine column and JSON search conditions
-        all_search_conditions = search_conditions + json_conditions
-        if all_search_conditions:
-            # Group search conditions together with OR
-            combined_search_condition = " OR ".join(all_search_conditions)
-            # Wrap the search conditions in parentheses to ensure correct precedence with other filters
-            conditions.append(f"({combined_search_condition})")
-
+    if search_query and SEARCH_INDEX_AVAILABLE and len(search_query) >= 3:
+        # Trigram index lookup; quoted as one phrase so it matches as a substring, like the LIKE chain below.
+        # Matches are materialized first and drive the join, so the other filters never steer the planner off the index.
+        query = ("WITH fts_matches AS (SELECT rowid FROM papers_fts WHERE papers_fts MATCH ?) "
+                 f"SELECT {select_list} FROM fts_matches JOIN papers ON papers.rowid = fts_matches.rowid")
+        params.insert(0, '"' + search_query.replace('"', '""') + '"') # The CTE's placeholder comes first
+    elif search_query:
+        # Fallback for queries too short for trigrams (or no FTS5): one LIKE over every searchable column.
+        # LIKE already ignores ASCII case, and the char(31) separator keeps a match from spanning two columns.
+        # % and _ are escaped so they match literally, as they do in the FTS phrase above.
+        conditions.append(f"({SEARCH_HAYSTACK}) LIKE ? ESCAPE '\\'")
+        params.append('%' + search_query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
 
     # --- Build Final Query ---
     if conditions:
         query += " WHERE " + " AND ".join(conditions)
+    # Rows come back in index order when idx_papers_filter is used; keep the table in import order
+    query += " ORDER BY papers.rowid"
 
     # Debug: Print the final query and params (optional)
     # print(f"DEBUG SQL Query: {query}")
     # print(f"DEBUG SQL Params: {params}")
 
-    papers = conn.execute(query, params).fetchall()
-    conn.close()
-
-    # --- Process Results (Same as before) ---
-    paper_list = []
-    for paper in papers:
+    # --- Process Results (only the derived fields whose source columns were selected) ---
+    cursor = conn.execute(query, params)
+    # Decided once from the projection rather than re-checked for every row
+    selected = {description[0] for description in cursor.description}
+    json_columns = [col for col in ('features', 'technique') if col in selected]
+    format_changed = 'changed' in selected
+    for paper in cursor:
         paper_dict = dict(paper)
-        try:
-            paper_dict['features'] = json.loads(paper_dict['features'])
-        except (json.JSONDecodeError, TypeError):
-            paper_dict['features'] = {}
-        try:
-            paper_dict['technique'] = json.loads(paper_dict['technique'])
-        except (json.JSONDecodeError, TypeError):
-            paper_dict['technique'] = {}
-        paper_dict['changed_formatted'] = format_changed_timestamp(paper_dict.get('changed'))
-        paper_dict['authors_truncated'] = truncate_authors(paper_dict.get('authors', ''))
-        paper_list.append(paper_dict)
-    return paper_list
+        for col in json_columns:
+            try:
+                paper_dict[col] = orjson.loads(paper_dict[col])
+            except (orjson.JSONDecodeError, TypeError):
+                paper_dict[col] = {}
+        if format_changed:
+            paper_dict['changed_formatted'] = format_changed_timestamp(paper_dict['changed'])
+        yield paper_dict
 
 # Editing functions: update_paper_custom_fields, fetch_updated_paper_data
-def update_paper_custom_fields(paper_id, data, changed_by="user"):
-    """Update the custom classification fields for a paper and audit fields.
-       Handles partial updates based on keys present in `data`."""
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    changed_timestamp = datetime.utcnow().isoformat() + 'Z'
+# Submitted tri-state strings (lowercased); 'unknown', '' and anything else not listed mean NULL
+TRISTATE_VALUES = {'true': True, '1': True, 'on': True, 'false': False, '0': False}
+
+def coerce_tristate(value):
+    """Maps a submitted tri-state field value to True, False or None (unknown)."""
+    if isinstance(value, str):
+        return TRISTATE_VALUES.get(value.lower())
+    return None if value is None else bool(value)
+
+# Columns the browser can edit directly, and the keys of the JSON columns it can edit
+MAIN_BOOL_FIELDS = ('is_survey', 'is_offtopic', 'is_through_hole', 'is_smt', 'is_x_ray')
+TRISTATE_COLUMNS = MAIN_BOOL_FIELDS + ('verified',)
+EDITABLE_COLUMNS = TRISTATE_COLUMNS + ('research_area', 'page_count', 'pages', 'verified_by', 'relevance', 'user_trace')
+# Keys an edit request may carry besides features_<key>/technique_<key>; pages is only backfilled from page_count
+EDIT_REQUEST_KEYS = frozenset(EDITABLE_COLUMNS) - {'pages'} | {'id'}
+EDITABLE_JSON_KEYS = {'features': tuple(globals.DEFAULT_FEATURES), 'technique': tuple(globals.DEFAULT_TECHNIQUE)}
+
+def _edit_expression(column):
+    """SET expression assigning :column only when :set_column is true."""
+    if column == 'pages':
+        # pages is only backfilled from page_count while it is still blank
+        return "pages = IIF(:set_pages AND (pages IS NULL OR trim(pages) = ''), :pages, pages)"
+    return f"{column} = IIF(:set_{column}, :{column}, {column})"
+
+def _json_edit_expression(column):
+    """SET expression merging the flagged keys into the stored JSON with json_set. Unflagged keys get
+       their current value back, and json_set rather than json_patch, which would drop keys set to null."""
+    base = f"COALESCE(NULLIF({column}, ''), '{{}}')"
+    slots = ", ".join(f"'$.{key}', IIF(:set_{column}_{key}, json(:{column}_{key}), {base} -> '$.{key}')"
+                      for key in EDITABLE_JSON_KEYS[column])
+    return f"{column} = IIF(:set_{column}, json_set({base}, {slots}), {column})"
+
+# One fixed statement for every combination of edited fields, so SQLite can reuse the prepared statement;
+# RETURNING hands back the updated row, so no second SELECT is needed to refresh the client
+PAPER_EDIT_QUERY = (
+    "UPDATE papers SET "
+    + ", ".join([_edit_expression(column) for column in EDITABLE_COLUMNS]
+                + [_json_edit_expression(column) for column in EDITABLE_JSON_KEYS])
+    + ", changed = :changed, changed_by = :changed_by WHERE id = :id RETURNING *"
+)
+
+def paper_edit_params(paper_id, values, json_values, changed_by):
+    """Builds the PAPER_EDIT_QUERY parameters; `values` and `json_values` hold only the edited fields."""
+    params = {'id': paper_id, 'changed': datetime.utcnow().isoformat() + 'Z', 'changed_by': changed_by}
+    for column in EDITABLE_COLUMNS:
+        params[f"set_{column}"] = column in values
+        params[column] = values.get(column)
+    for column, keys in EDITABLE_JSON_KEYS.items():
+        updates = json_values.get(column, {})
+        params[f"set_{column}"] = bool(updates)
+        for key in keys:
+            params[f"set_{column}_{key}"] = key in updates
+            params[f"{column}_{key}"] = orjson.dumps(updates[key]).decode() if key in updates else None
+    return params
+
+def paper_edit_values(data):
+    """Maps an edit request to (values, json_values) for paper_edit_params.
+       Handles partial updates based on keys present in `data`; raises ValueError on keys it cannot store."""
+    unknown_keys = [key for key in data
+                    if key not in EDIT_REQUEST_KEYS and key.partition('_')[0] not in EDITABLE_JSON_KEYS]
+    if unknown_keys:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown_keys))}")
+
+    values = {} # Edited columns and their new values
+
+    # Handle Main Boolean Fields and Verified (Partial Update)
+    for field in TRISTATE_COLUMNS:
+        if field in data:
+            values[field] = coerce_tristate(data[field]) # Booleans bind as 1/0
 
-    update_fields = []
-    update_values = []
+    # Handle Research Area, Relevance and User Comments (Partial Update)
+    for column in ('research_area', 'relevance', 'user_trace'):
+        if column in data:
+            values[column] = data[column]
 
-    # Handle Main Boolean Fields (Partial Update)
-    main_bool_fields = ['is_survey', 'is_offtopic', 'is_through_hole', 'is_smt', 'is_x_ray']
-    for field in main_bool_fields:
-        if field in data:
-            value = data[field]
-            if isinstance(value, str):
-                if value.lower() in ('true', '1', 'on'):
-                    update_fields.append(f"{field} = ?")
-                    update_values.append(1)
-                elif value.lower() in ('false', '0'):
-                    update_fields.append(f"{field} = ?")
-                    update_values.append(0)
-                else: # 'unknown', '', None, etc.
-                    update_fields.append(f"{field} = ?")
-                    update_values.append(None)
-            elif value is True:
-                update_fields.append(f"{field} = ?")
-                update_values.append(1)
-            elif value is False:
-                update_fields.append(f"{field} = ?")
-                update_values.append(0)
-            else: # value is None or numeric
-                update_fields.append(f"{field} = ?")
-                update_values.append(int(bool(value)) if value is not None else None)
-
-    # Handle Research Area (Partial Update)
-    if 'research_area' in data:
-        update_fields.append("research_area = ?")
-        update_values.append(data['research_area'])
-
-
-    page_count_value_for_pages_update = None # Variable to hold the value for potential 'pages' update
     if 'page_count' in data:
-        page_count_value = data['page_count']
+        page_count_value = safe_int(data['page_count']) # None if missing or invalid
+        values['page_count'] = page_count_value
         if page_count_value is not None:
-            try:
-                page_count_value = int(page_count_value)
-                # Store the integer value for potential 'pages' update
-                page_count_value_for_pages_update = page_count_value 
-            except (ValueError, TypeError):
-                page_count_value = None
-                page_count_value_for_pages_update = None # Reset if invalid
-        else:
-            page_count_value_for_pages_update = None # Reset if None
-        
-        update_fields.append("page_count = ?")
-        update_values.append(page_count_value)
-
-        cursor.execute("SELECT pages FROM papers WHERE id = ?", (paper_id,))
-        row = cursor.fetchone()
-        if row:
-            current_pages_value = row['pages']
-            # Check if 'pages' is effectively empty/blank/null
-            # This checks for None, empty string, or string with only whitespace
-            if current_pages_value is None or (isinstance(current_pages_value, str) and current_pages_value.strip() == ""):
-                # If 'pages' is blank and we have a valid page_count to set
-                if page_count_value_for_pages_update is not None:
-                    # Add the update for the 'pages' column
-                    update_fields.append("pages = ?")
-                    # Convert the integer page count back to string for the 'pages' TEXT column
-                    update_values.append(str(page_count_value_for_pages_update)) 
-        # --- END NEW LOGIC ---
+            # Backfill the 'pages' TEXT column; the UPDATE only applies it if 'pages' is blank/null
+            values['pages'] = str(page_count_value)
 
     # Handle Verified By (Partial Update)
     if 'verified_by' in data:
-        verified_by_value = data['verified_by']
         # Ensure value is either 'user' or None. Others (like model names) are treated as None.
         # This enforces that the UI can only set 'user' or clear it.
-        if verified_by_value != 'user':
-            verified_by_value = None
-        update_fields.append("verified_by = ?")
-        update_values.append(verified_by_value)
-        
-
-    # Handle Features (Partial Update)
-    # Fetch current features JSON from DB to merge changes
-    cursor.execute("SELECT features FROM papers WHERE id = ?", (paper_id,))
-    row = cursor.fetchone()
-    if row:
-        try:
-            current_features = json.loads(row['features']) if row['features'] else {}
-        except (json.JSONDecodeError, TypeError):
-            current_features = {}
-    else:
-        current_features = {}
-
-    # Check for feature fields in the incoming data
-    feature_updates = {}
-    for key in list(data.keys()): # Iterate over a copy to safely modify data
-        if key.startswith('features_'):
-            feature_key = key.split('features_')[1]
-            value = data.pop(key) # Remove from main data dict
-            if feature_key == 'other':
-                feature_updates[feature_key] = value # Text field
-            else:
-                # Handle radio button group for 3-state (true/false/unknown)
-                if isinstance(value, str):
-                    if value == 'true':
-                        feature_updates[feature_key] = True
-                    elif value == 'false':
-                        feature_updates[feature_key] = False
-                    else: # 'unknown' or anything else
-                        feature_updates[feature_key] = None
-                elif isinstance(value, bool):
-                    feature_updates[feature_key] = value
-                else: # None or numeric
-                    feature_updates[feature_key] = bool(value) if value is not None else None
-
-    if feature_updates:
-        current_features.update(feature_updates)
-        update_fields.append("features = ?")
-        update_values.append(json.dumps(current_features))
-
-    # Handle Techniques (Partial Update)
-    # Fetch current technique JSON from DB to merge changes
-    cursor.execute("SELECT technique FROM papers WHERE id = ?", (paper_id,))
-    row = cursor.fetchone()
-    if row:
-        try:
-            current_technique = json.loads(row['technique']) if row['technique'] else {}
-        except (json.JSONDecodeError, TypeError):
-            current_technique = {}
-    else:
-        current_technique = {}
-
-    # Check for technique fields in the (potentially modified) data
-    technique_updates = {}
-    for key in list(data.keys()):
-        if key.startswith('technique_'):
-            technique_key = key.split('technique_')[1]
-            value = data.pop(key) # Remove from main data dict
-            if technique_key == 'model':
-                technique_updates[technique_key] = value # Text field
-            elif technique_key == 'available_dataset':
-                 # Handle radio button group for 3-state (true/false/unknown)
-                if isinstance(value, str):
-                    if value == 'true':
-                        technique_updates[technique_key] = True
-                    elif value == 'false':
-                        technique_updates[technique_key] = False
-                    else: # 'unknown' or anything else
-                        technique_updates[technique_key] = None
-                elif isinstance(value, bool):
-                    technique_updates[technique_key] = value
-                else: # None or numeric
-                    technique_updates[technique_key] = bool(value) if value is not None else None
-            else: # classic_computer_vision_based, machine_learning_based, hybrid
-                 # Handle radio button group for 3-state (true/false/unknown)
-                if isinstance(value, str):
-                    if value == 'true':
-                        technique_updates[technique_key] = True
-                    elif value == 'false':
-                        technique_updates[technique_key] = False
-                    else: # 'unknown' or anything else
-                        technique_updates[technique_key] = None
-                elif isinstance(value, bool):
-                    technique_updates[technique_key] = value
-                else: # None or numeric
-                    technique_updates[technique_key] = bool(value) if value is not None else None
-
-    # Merge updates into current technique
-    if technique_updates:
-        current_technique.update(technique_updates)
-        update_fields.append("technique = ?")
-        update_values.append(json.dumps(current_technique))
-
-    # Always update audit fields for any change
-    update_fields.append("changed = ?")
-    update_values.append(changed_timestamp)
-    update_fields.append("changed_by = ?")
-    update_values.append(changed_by)
-
-    # Any remaining keys in 'data' are assumed to be direct column names
-    for key, value in data.items(): # Iterate over the potentially modified data dict
-        # Skip keys already handled or special keys
-        if key in ['id', 'changed', 'changed_by', 'verified_by'] or key in main_bool_fields or key.startswith(('features_', 'technique_')):
-            continue
-        # Treat remaining keys as direct column updates
-        update_fields.append(f"{key} = ?")
-        update_values.append(value)
-
-    if update_fields:
-        update_query = f"UPDATE papers SET {', '.join(update_fields)} WHERE id = ?"
-        update_values.append(paper_id)
-        # --- Debug prints ---
-        # print(f"DEBUG: Updating paper {paper_id}")
-        # print(f"DEBUG: SQL Query: {update_query}")
-        # print(f"DEBUG: Values: {update_values}")
-        # --- End Debug prints ---
-        cursor.execute(update_query, update_values)
-        conn.commit()
-        rows_affected = cursor.rowcount
-    else:
-        rows_affected = 0 # No fields to update
-    conn.close()
+        values['verified_by'] = 'user' if data['verified_by'] == 'user' else None
+
+    # Handle Features and Techniques (Partial Update): features_<key> / technique_<key>
+    json_values = {'features': {}, 'technique': {}}
+    for key, value in data.items():
+        column, _, json_key = key.partition('_')
+        if column in json_values and json_key in EDITABLE_JSON_KEYS[column]:
+            if json_key in ('other', 'model'):
+                json_values[column][json_key] = value # Text field
+            else: # Radio button group for 3-state (true/false/unknown)
+                json_values[column][json_key] = coerce_tristate(value)
+    return values, json_values
+
+def paper_edit_result(updated_paper):
+    """Builds the client response for one row returned by PAPER_EDIT_QUERY (None if no paper matched)."""
+    rows_affected = 1 if updated_paper else 0
 
     if rows_affected > 0:
-        conn = get_db_connection()
-        updated_paper = conn.execute("SELECT * FROM papers WHERE id = ?", (paper_id,)).fetchone()
-        conn.close()
-        
         if updated_paper:
             updated_dict = dict(updated_paper)
             try:
-                updated_dict['features'] = json.loads(updated_dict['features'])
-            except (json.JSONDecodeError, TypeError):
+                updated_dict['features'] = orjson.loads(updated_dict['features'])
+            except (orjson.JSONDecodeError, TypeError):
                 updated_dict['features'] = {}
             try:
-                updated_dict['technique'] = json.loads(updated_dict['technique'])
-            except (json.JSONDecodeError, TypeError):
+                updated_dict['technique'] = orjson.loads(updated_dict['technique'])
+            except (orjson.JSONDecodeError, TypeError):
                 updated_dict['technique'] = {}
             
             updated_dict['changed_formatted'] = format_changed_timestamp(updated_dict.get('changed'))
@@ -393,6 +354,7 @@ def update_paper_custom_fields(paper_id, data, changed_by="user"):
                 'is_through_hole': updated_dict.get('is_through_hole'),
                 'is_smt': updated_dict.get('is_smt'),
                 'is_x_ray': updated_dict.get('is_x_ray'),
+                'verified': updated_dict.get('verified'),
                 'relevance': updated_dict.get('relevance'),
                 'features': updated_dict['features'], # Parsed dict
                 'technique': updated_dict['technique'], # Parsed dict
@@ -404,55 +366,72 @@ def update_paper_custom_fields(paper_id, data, changed_by="user"):
     else:
         return {'status': 'error', 'message': 'No rows updated. Paper ID might not exist or no changes were made.'}
 
+def update_paper_custom_fields(paper_id, data, changed_by="user"):
+    """Update the custom classification fields for a paper and audit fields."""
+    conn = get_db_connection()
+    # Audit fields (changed, changed_by) are updated on every call
+    updated_paper = conn.execute(PAPER_EDIT_QUERY, paper_edit_params(paper_id, *paper_edit_values(data), changed_by)).fetchone()
+    return paper_edit_result(updated_paper)
+
+def update_papers_bulk(items, changed_by="user"):
+    """Applies several edits (each a dict like update_paper_custom_fields' data, including 'id')
+       in a single transaction, so the batch costs one commit. Returns one result per item."""
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        updated_papers = [
+            cursor.execute(PAPER_EDIT_QUERY, paper_edit_params(item.get('id'), *paper_edit_values(item), changed_by)).fetchone()
+            for item in items
+        ]
+    return [paper_edit_result(updated_paper) for updated_paper in updated_papers]
+
 def fetch_updated_paper_data(paper_id):
     """Fetches the full paper data after classification/verification for client-side update."""
     conn = get_db_connection()
-    try:
-        updated_paper = conn.execute("SELECT * FROM papers WHERE id = ?", (paper_id,)).fetchone()
-        if updated_paper:
-            updated_dict = dict(updated_paper)
-            try:
-                updated_dict['features'] = json.loads(updated_dict['features'])
-            except (json.JSONDecodeError, TypeError):
-                updated_dict['features'] = {}
-            try:
-                updated_dict['technique'] = json.loads(updated_dict['technique'])
-            except (json.JSONDecodeError, TypeError):
-                updated_dict['technique'] = {}
-            updated_dict['changed_formatted'] = format_changed_timestamp(updated_dict.get('changed'))
-            
-            # Prepare data for frontend refresh (matching update_paper_custom_fields structure)
-            return_data = {
-                'status': 'success',
-                'changed': updated_dict.get('changed'),
-                'changed_formatted': updated_dict['changed_formatted'],
-                'changed_by': updated_dict.get('changed_by'),
-                'verified_by': updated_dict.get('verified_by'),
-                # Include updated fields for frontend refresh
-                'research_area': updated_dict.get('research_area'),
-                'page_count': updated_dict.get('page_count'),
-                'is_survey': updated_dict.get('is_survey'),
-                'is_offtopic': updated_dict.get('is_offtopic'),
-                'is_through_hole': updated_dict.get('is_through_hole'),
-                'is_smt': updated_dict.get('is_smt'),
-                'is_x_ray': updated_dict.get('is_x_ray'),
-                'relevance': updated_dict.get('relevance'),
-                'verified': updated_dict.get('verified'),
-                'estimated_score': updated_dict.get('estimated_score'),
-                'features': updated_dict['features'], # Parsed dict
-                'technique': updated_dict['technique'], # Parsed dict
-                'reasoning_trace': updated_dict.get('reasoning_trace'), # Include traces
-                'verifier_trace': updated_dict.get('verifier_trace'),
-                'user_trace': updated_dict.get('user_trace')
-            }
-            return return_data
-        else:
-            return {'status': 'error', 'message': 'Paper not found after update.'}
-    finally:
-        conn.close()
+    updated_paper = conn.execute("SELECT * FROM papers WHERE id = ?", (paper_id,)).fetchone()
+    if updated_paper:
+        updated_dict = dict(updated_paper)
+        try:
+            updated_dict['features'] = orjson.loads(updated_dict['features'])
+        except (orjson.JSONDecodeError, TypeError):
+            updated_dict['features'] = {}
+        try:
+            updated_dict['technique'] = orjson.loads(updated_dict['technique'])
+        except (orjson.JSONDecodeError, TypeError):
+            updated_dict['technique'] = {}
+        updated_dict['changed_formatted'] = format_changed_timestamp(updated_dict.get('changed'))
+        
+        # Prepare data for frontend refresh (matching update_paper_custom_fields structure)
+        return_data = {
+            'status': 'success',
+            'changed': updated_dict.get('changed'),
+            'changed_formatted': updated_dict['changed_formatted'],
+            'changed_by': updated_dict.get('changed_by'),
+            'verified_by': updated_dict.get('verified_by'),
+            # Include updated fields for frontend refresh
+            'research_area': updated_dict.get('research_area'),
+            'page_count': updated_dict.get('page_count'),
+            'is_survey': updated_dict.get('is_survey'),
+            'is_offtopic': updated_dict.get('is_offtopic'),
+            'is_through_hole': updated_dict.get('is_through_hole'),
+            'is_smt': updated_dict.get('is_smt'),
+            'is_x_ray': updated_dict.get('is_x_ray'),
+            'relevance': updated_dict.get('relevance'),
+            'verified': updated_dict.get('verified'),
+            'estimated_score': updated_dict.get('estimated_score'),
+            'features': updated_dict['features'], # Parsed dict
+            'technique': updated_dict['technique'], # Parsed dict
+            'reasoning_trace': updated_dict.get('reasoning_trace'), # Include traces
+            'verifier_trace': updated_dict.get('verifier_trace'),
+            'user_trace': updated_dict.get('user_trace')
+        }
+        return return_data
+    else:
+        return {'status': 'error', 'message': 'Paper not found after update.'}
 
 # render_papers_table Used for initial render from / and XHR updates     
-def render_papers_table(hide_offtopic_param=None, year_from_param=None, year_to_param=None, min_page_count_param=None, search_query_param=None):
+def render_papers_table(hide_offtopic_param=None, year_from_param=None, year_to_param=None, min_page_count_param=None, search_query_param=None, json_filters=None):
     """Fetches papers based on filters and renders the papers_table.html template."""
     try:
         # Determine hide_offtopic state
@@ -461,9 +440,9 @@ def render_papers_table(hide_offtopic_param=None, year_from_param=None, year_to_
             hide_offtopic = hide_offtopic_param.lower() in ['1', 'true', 'yes', 'on']
 
         # Determine filter values, using defaults if not provided or invalid
-        year_from_value = int(year_from_param) if year_from_param is not None else DEFAULT_YEAR_FROM
-        year_to_value = int(year_to_param) if year_to_param is not None else DEFAULT_YEAR_TO
-        min_page_count_value = int(min_page_count_param) if min_page_count_param is not None else DEFAULT_MIN_PAGE_COUNT
+        year_from_value = safe_int(year_from_param, DEFAULT_YEAR_FROM)
+        year_to_value = safe_int(year_to_param, DEFAULT_YEAR_TO)
+        min_page_count_value = safe_int(min_page_count_param, DEFAULT_MIN_PAGE_COUNT)
         # --- NEW: Determine search query value ---
         search_query_value = search_query_param if search_query_param is not None else ""
 
@@ -473,7 +452,9 @@ def render_papers_table(hide_offtopic_param=None, year_from_param=None, year_to_
             year_from=year_from_value,
             year_to=year_to_value,
             min_page_count=min_page_count_value,
-            search_query=search_query_value # Pass the search query
+            search_query=search_query_value, # Pass the search query
+            json_filters=json_filters,
+            columns=TABLE_COLUMNS
         )
 
         # Render the table template fragment, passing the search query value for the input field
@@ -492,11 +473,77 @@ def render_papers_table(hide_offtopic_param=None, year_from_param=None, year_to_
         )
         return rendered_table
     except Exception as e:
-        # Log the error or handle it appropriately
+        # Log and re-raise: a failed render must not be memoized by cached_papers_table;
+        # the routes answer with TABLE_ERROR_HTML and a 500 instead
         print(f"Error rendering papers table: {e}")
-        # Return an error fragment or re-raise if preferred for the main route
-        return "<p>Error loading table.</p>" # Basic error display
-
+        raise
+
+
+# --- Table render cache ---
+# Long-lived connection used only to read PRAGMA data_version, which changes whenever
+# any other connection (this app's requests, the classifier, an import) commits
+_version_conn = None
+_version_lock = threading.Lock()
+
+def database_version():
+    """Returns a token that changes whenever the database has been modified since the last call."""
+    global _version_conn
+    with _version_lock:
+        if _version_conn is None:
+            _version_conn = sqlite3.connect(DATABASE, check_same_thread=False)
+        return _version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+# data_version values restart with the process, so ETags also carry an id of this server run
+SERVER_RUN_ID = uuid.uuid4().hex[:8]
+
+def etag_by_database_version(view):
+    """Makes a GET view conditional: its ETag is the database version (the response depends only on the query
+       string and the database), so a matching If-None-Match is answered 304 without running the view."""
+    @functools.wraps(view)
+    def conditional_view(*args, **kwargs):
+        etag = f"{SERVER_RUN_ID}-{database_version()}"
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response # Errors are never revalidated
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, max-age=0, must-revalidate' # Browsers revalidate every time
+        return response
+    return conditional_view
+
+TABLE_ERROR_HTML = "<p>Error loading table.</p>" # Basic error display
+
+@functools.lru_cache(maxsize=16)
+def cached_papers_table(data_version, json_filter_items=(), **filter_params):
+    """render_papers_table, memoized per database version and filters (json_filters as sorted items).
+       A new data_version makes older entries unreachable; they age out of the LRU."""
+    return render_papers_table(json_filters=dict(json_filter_items), **filter_params)
+
+# --- Static files inlined into /static_export ---
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_EXPORT_FILES = {
+    'fonts_css_content': 'fonts.css',
+    'style_css_content': 'style.css',
+    'chart_js_content': 'chart.js',
+    'ghpages_js_content': 'ghpages.js'
+}
+_static_export_cache = {} # file name -> (mtime, Markup contents)
+STATIC_EXPORT_STREAM_BUFFER = 500
+
+def static_export_assets():
+    """Returns the template arguments for the inlined static files, read once and re-read only when modified."""
+    assets = {}
+    for param, name in STATIC_EXPORT_FILES.items():
+        path = os.path.join(STATIC_DIR, name)
+        mtime = os.path.getmtime(path)
+        cached = _static_export_cache.get(name)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = _static_export_cache[name] = (mtime, Markup(f.read()))
+        assets[param] = cached[1]
+    return assets
 
 #Routes: 
 @app.route('/', methods=['GET'])
@@ -510,30 +557,26 @@ def index():
 
     search_query_param = request.args.get('search_query')
     
-    papers_table_content = render_papers_table(
-        hide_offtopic_param=hide_offtopic_param,
-        year_from_param=year_from_param,
-        year_to_param=year_to_param,
-        min_page_count_param=min_page_count_param,
-        search_query_param=search_query_param  # Add this line
-    )
+    status = 200
+    try:
+        papers_table_content = cached_papers_table(
+            database_version(),
+            hide_offtopic_param=hide_offtopic_param,
+            year_from_param=year_from_param,
+            year_to_param=year_to_param,
+            min_page_count_param=min_page_count_param,
+            search_query_param=search_query_param,  # Add this line
+            json_filter_items=tuple(sorted(parse_json_filters(request.args).items()))
+        )
+    except Exception:
+        # Already logged by render_papers_table; still serve the page around the error
+        papers_table_content, status = TABLE_ERROR_HTML, 500
 
     # Pass the rendered table content and filter values to the main index template
     # Determine values to display in the input fields (use defaults if URL params were missing/invalid)
-    try:
-        year_from_input_value = str(int(year_from_param)) if year_from_param is not None else str(DEFAULT_YEAR_FROM)
-    except ValueError:
-        year_from_input_value = str(DEFAULT_YEAR_FROM)
-
-    try:
-        year_to_input_value = str(int(year_to_param)) if year_to_param is not None else str(DEFAULT_YEAR_TO)
-    except ValueError:
-        year_to_input_value = str(DEFAULT_YEAR_TO)
-
-    try:
-        min_page_count_input_value = str(int(min_page_count_param)) if min_page_count_param is not None else str(DEFAULT_MIN_PAGE_COUNT)
-    except ValueError:
-        min_page_count_input_value = str(DEFAULT_MIN_PAGE_COUNT)
+    year_from_input_value = str(safe_int(year_from_param, DEFAULT_YEAR_FROM))
+    year_to_input_value = str(safe_int(year_to_param, DEFAULT_YEAR_TO))
+    min_page_count_input_value = str(safe_int(min_page_count_param, DEFAULT_MIN_PAGE_COUNT))
 
     hide_offtopic_checkbox_checked = hide_offtopic_param is None or hide_offtopic_param.lower() in ['1', 'true', 'yes', 'on']
     search_input_value = search_query_param if search_query_param is not None else ""
@@ -546,7 +589,7 @@ def index():
         year_to_value=year_to_input_value,
         min_page_count_value=min_page_count_input_value,
         search_query_value=search_input_value  # Add this line
-    )
+    ), status
 
 @app.route('/static_export', methods=['GET'])
 def static_export():
@@ -564,9 +607,9 @@ def static_export():
         if hide_offtopic_param is not None:
             hide_offtopic = hide_offtopic_param.lower() in ['1', 'true', 'yes', 'on']
 
-        year_from_value = int(year_from_param) if year_from_param is not None else DEFAULT_YEAR_FROM
-        year_to_value = int(year_to_param) if year_to_param is not None else DEFAULT_YEAR_TO
-        min_page_count_value = int(min_page_count_param) if min_page_count_param is not None else DEFAULT_MIN_PAGE_COUNT
+        year_from_value = safe_int(year_from_param, DEFAULT_YEAR_FROM)
+        year_to_value = safe_int(year_to_param, DEFAULT_YEAR_TO)
+        min_page_count_value = safe_int(min_page_count_param, DEFAULT_MIN_PAGE_COUNT)
         search_query_value = search_query_param if search_query_param is not None else ""
 
         # --- Fetch papers based on these filters ---
@@ -575,54 +618,28 @@ def static_export():
             year_from=year_from_value,
             year_to=year_to_value,
             min_page_count=min_page_count_value,
-            search_query=search_query_value # Pass the search query
+            search_query=search_query_value, # Pass the search query
+            json_filters=parse_json_filters(request.args)
         )
 
-        # --- Read static file contents ---
-        fonts_css_content = ""
-        style_css_content = ""
-        chart_js_content = ""
-        ghpages_js_content = ""
-        # Assuming static files are in a 'static' directory relative to the script
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        static_dir = os.path.join(script_dir, 'static')
-        with open(os.path.join(static_dir, 'fonts.css'), 'r') as f:
-            fonts_css_content = f.read()
-        with open(os.path.join(static_dir, 'style.css'), 'r') as f:
-            style_css_content = f.read()
-        with open(os.path.join(static_dir, 'chart.js'), 'r') as f:
-            chart_js_content = f.read()
-        with open(os.path.join(static_dir, 'ghpages.js'), 'r', encoding='utf-8') as f:
-            ghpages_js_content = f.read()
-
-        # --- Render the static export template ---
-        papers_table_static_export = render_template(
-            'papers_table_static_export.html',
+        # --- Stream the main static export index template (it includes the table template) ---
+        # Rows are fetched, rendered and sent in chunks instead of building the whole document first
+        export_template = app.jinja_env.get_template('index_static_export.html')
+        export_context = dict(
             papers=papers,
             type_emojis=globals.TYPE_EMOJIS,
             default_type_emoji=globals.DEFAULT_TYPE_EMOJI,
             hide_offtopic=hide_offtopic,
-            year_from_value=str(year_from_value),
-            year_to_value=str(year_to_value),
-            min_page_count_value=str(min_page_count_value),
-            search_query_value=search_query_value
-        )
-
-        # --- Render the main static export index template ---
-        full_html_content = render_template(
-            'index_static_export.html',
-            papers_table_static_export=papers_table_static_export,
-            hide_offtopic=hide_offtopic,
             year_from_value=year_from_value, # Pass raw values if needed by template logic
             year_to_value=year_to_value,
             min_page_count_value=min_page_count_value,
             search_query=search_query_value,
             # --- Pass static content ---
-            fonts_css_content=Markup(fonts_css_content),
-            style_css_content=Markup(style_css_content),
-            chart_js_content=Markup(chart_js_content),
-            ghpages_js_content=Markup(ghpages_js_content)
+            **static_export_assets()
         )
+        app.update_template_context(export_context)
+        html_stream = export_template.stream(export_context)
+        html_stream.enable_buffering(STATIC_EXPORT_STREAM_BUFFER) # Template events per written chunk
 
         # --- Create a filename based on filters ---
         filename_parts = ["PCBPapers"]
@@ -642,9 +659,9 @@ def static_export():
         filename = "_".join(filename_parts) + ".html"
 
         # --- Return as a downloadable attachment ---
-        from flask import Response
+        from flask import Response, stream_with_context
         return Response(
-            full_html_content,
+            stream_with_context(html_stream), # Keeps the request (and its DB connection) alive while streaming
             mimetype="text/html",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
@@ -655,6 +672,27 @@ def static_export():
         return "Error generating export file.", 500
 
 
+@functools.lru_cache(maxsize=512)
+def cached_detail_row(data_version, paper_id):
+    """Renders the detail row fragment for a paper (None if it does not exist), memoized per database
+       version like cached_papers_table, so re-expanding a row skips the query, JSON parsing and render."""
+    conn = get_db_connection()
+    paper = conn.execute(f"SELECT {', '.join(DETAIL_COLUMNS)} FROM papers WHERE id = ?", (paper_id,)).fetchone()
+    if paper is None:
+        return None
+    # Process the paper data like in fetch_papers for consistency
+    paper_dict = dict(paper)
+    try:
+        paper_dict['features'] = orjson.loads(paper_dict['features'])
+    except (orjson.JSONDecodeError, TypeError):
+        paper_dict['features'] = {}
+    try:
+        paper_dict['technique'] = orjson.loads(paper_dict['technique'])
+    except (orjson.JSONDecodeError, TypeError):
+        paper_dict['technique'] = {}
+    # Render the detail row template fragment for this specific paper
+    return render_template('detail_row.html', paper=paper_dict)
+
 @app.route('/get_detail_row', methods=['GET'])
 def get_detail_row():
     """Endpoint to fetch and render the detail row content for a specific paper."""
@@ -663,24 +701,8 @@ def get_detail_row():
         return jsonify({'status': 'error', 'message': 'Paper ID is required'}), 400
 
     try:
-        conn = get_db_connection()
-        paper = conn.execute("SELECT * FROM papers WHERE id = ?", (paper_id,)).fetchone()
-        conn.close()
-
-        if paper:
-            # Process the paper data like in fetch_papers for consistency
-            paper_dict = dict(paper)
-            try:
-                paper_dict['features'] = json.loads(paper_dict['features'])
-            except (json.JSONDecodeError, TypeError):
-                paper_dict['features'] = {}
-            try:
-                paper_dict['technique'] = json.loads(paper_dict['technique'])
-            except (json.JSONDecodeError, TypeError):
-                paper_dict['technique'] = {}
-            
-            # Render the detail row template fragment for this specific paper
-            detail_html = render_template('detail_row.html', paper=paper_dict)
+        detail_html = cached_detail_row(database_version(), paper_id)
+        if detail_html is not None:
             return jsonify({'status': 'success', 'html': detail_html})
         else:
             return jsonify({'status': 'error', 'message': 'Paper not found'}), 404
@@ -690,6 +712,7 @@ def get_detail_row():
 
 # Endpoint to load the table content via AJAX 
 @app.route('/load_table', methods=['GET'])
+@etag_by_database_version
 def load_table():
     """Endpoint to fetch and render the table content based on current filters."""
     # Get filter parameters from the request
@@ -700,16 +723,90 @@ def load_table():
     search_query_param = request.args.get('search_query')
 
     # Use the updated helper function to render the table, passing the search query
-    table_html = render_papers_table(
-        hide_offtopic_param=hide_offtopic_param,
-        year_from_param=year_from_param,
-        year_to_param=year_to_param,
-        min_page_count_param=min_page_count_param,
-        search_query_param=search_query_param # Pass the search query
-    )
+    try:
+        table_html = cached_papers_table(
+            database_version(),
+            hide_offtopic_param=hide_offtopic_param,
+            year_from_param=year_from_param,
+            year_to_param=year_to_param,
+            min_page_count_param=min_page_count_param,
+            search_query_param=search_query_param, # Pass the search query
+            json_filter_items=tuple(sorted(parse_json_filters(request.args).items()))
+        )
+    except Exception:
+        # Already logged by render_papers_table; a 500 is neither memoized nor given an ETag
+        return TABLE_ERROR_HTML, 500
     return table_html
 
+@functools.lru_cache(maxsize=16)
+def cached_stats(data_version, hide_offtopic, year_from, year_to, min_page_count, search_query, json_filter_items=()):
+    """Counts repeating journals, keywords, authors and research areas among the filtered papers.
+       Memoized per database version and normalized filters like cached_papers_table, so bursts of
+       identical /get_stats requests are counted once."""
+    # --- Fetch papers based on these filters ---
+    papers = fetch_papers(
+        hide_offtopic=hide_offtopic,
+        year_from=year_from,
+        year_to=year_to,
+        min_page_count=min_page_count,
+        search_query=search_query,
+        json_filters=dict(json_filter_items),
+        columns=STATS_COLUMNS
+    )
+
+    # --- Calculate Stats from Fetched Papers ---
+    journal_counter = Counter()
+    keyword_counter = Counter()
+    author_counter = Counter()
+    research_area_counter = Counter()
+
+    for paper in papers:
+        # --- Journal/Conf ---
+        journal = paper.get('journal')
+        if journal:
+            journal_counter[journal] += 1
+
+        # --- Keywords ---
+        # Keywords are stored as a single string, split by ';'
+        keywords_str = paper.get('keywords', '')
+        if keywords_str:
+             # Split robustly, handling potential extra spaces
+             keywords_list = [kw.strip() for kw in keywords_str.split(';') if kw.strip()]
+             keyword_counter.update(keywords_list)
+
+        # --- Authors ---
+        # Authors are stored as a single string, split by ';'
+        authors_str = paper.get('authors', '')
+        if authors_str:
+            # Split robustly, handling potential extra spaces
+            authors_list = [author.strip() for author in authors_str.split(';') if author.strip()]
+            author_counter.update(authors_list)
+
+        # --- Research Area ---
+        research_area = paper.get('research_area')
+        if research_area:
+            research_area_counter[research_area] += 1
+
+    # --- Filter counts > 1 and sort (matching client-side logic) ---
+    def filter_and_sort(counter):
+        # Filter items with count > 1
+        filtered_items = {item: count for item, count in counter.items() if count > 1}
+        # Sort by count descending, then by name ascending
+        sorted_items = sorted(filtered_items.items(), key=lambda x: (-x[1], x[0]))
+        # Convert back to a list of dictionaries for JSON serialization
+        return [{'name': name, 'count': count} for name, count in sorted_items]
+
+    stats_data = {
+        'journals': filter_and_sort(journal_counter),
+        'keywords': filter_and_sort(keyword_counter),
+        'authors': filter_and_sort(author_counter),
+        'research_areas': filter_and_sort(research_area_counter)
+    }
+
+    return stats_data
+
 @app.route('/get_stats', methods=['GET'])
+@etag_by_database_version
 def get_stats():
     """Endpoint to fetch statistics (repeating journals, keywords, authors, research areas) based on current filters."""
     
@@ -727,69 +824,20 @@ def get_stats():
         if hide_offtopic_param is not None:
             hide_offtopic = hide_offtopic_param.lower() in ['1', 'true', 'yes', 'on']
 
-        year_from_value = int(year_from_param) if year_from_param is not None else DEFAULT_YEAR_FROM
-        year_to_value = int(year_to_param) if year_to_param is not None else DEFAULT_YEAR_TO
-        min_page_count_value = int(min_page_count_param) if min_page_count_param is not None else DEFAULT_MIN_PAGE_COUNT
+        year_from_value = safe_int(year_from_param, DEFAULT_YEAR_FROM)
+        year_to_value = safe_int(year_to_param, DEFAULT_YEAR_TO)
+        min_page_count_value = safe_int(min_page_count_param, DEFAULT_MIN_PAGE_COUNT)
         search_query_value = search_query_param if search_query_param is not None else ""
 
-        # --- Fetch papers based on these filters ---
-        papers = fetch_papers(
-            hide_offtopic=hide_offtopic,
-            year_from=year_from_value,
-            year_to=year_to_value,
-            min_page_count=min_page_count_value,
-            search_query=search_query_value
+        stats_data = cached_stats(
+            database_version(),
+            hide_offtopic,
+            year_from_value,
+            year_to_value,
+            min_page_count_value,
+            search_query_value,
+            json_filter_items=tuple(sorted(parse_json_filters(request.args).items()))
         )
-
-        # --- Calculate Stats from Fetched Papers ---
-        journal_counter = Counter()
-        keyword_counter = Counter()
-        author_counter = Counter()
-        research_area_counter = Counter()
-
-        for paper in papers:
-            # --- Journal/Conf ---
-            journal = paper.get('journal')
-            if journal:
-                journal_counter[journal] += 1
-
-            # --- Keywords ---
-            # Keywords are stored as a single string, split by ';'
-            keywords_str = paper.get('keywords', '')
-            if keywords_str:
-                 # Split robustly, handling potential extra spaces
-                 keywords_list = [kw.strip() for kw in keywords_str.split(';') if kw.strip()]
-                 keyword_counter.update(keywords_list)
-
-            # --- Authors ---
-            # Authors are stored as a single string, split by ';'
-            authors_str = paper.get('authors', '')
-            if authors_str:
-                # Split robustly, handling potential extra spaces
-                authors_list = [author.strip() for author in authors_str.split(';') if author.strip()]
-                author_counter.update(authors_list)
-
-            # --- Research Area ---
-            research_area = paper.get('research_area')
-            if research_area:
-                research_area_counter[research_area] += 1
-
-        # --- Filter counts > 1 and sort (matching client-side logic) ---
-        def filter_and_sort(counter):
-            # Filter items with count > 1
-            filtered_items = {item: count for item, count in counter.items() if count > 1}
-            # Sort by count descending, then by name ascending
-            sorted_items = sorted(filtered_items.items(), key=lambda x: (-x[1], x[0]))
-            # Convert back to a list of dictionaries for JSON serialization
-            return [{'name': name, 'count': count} for name, count in sorted_items]
-
-        stats_data = {
-            'journals': filter_and_sort(journal_counter),
-            'keywords': filter_and_sort(keyword_counter),
-            'authors': filter_and_sort(author_counter),
-            'research_areas': filter_and_sort(research_area_counter)
-        }
-
         return jsonify({'status': 'success', 'data': stats_data})
 
     except Exception as e:
@@ -798,8 +846,18 @@ def get_stats():
 
 @app.route('/update_paper', methods=['POST'])
 def update_paper():
-    """Endpoint to handle AJAX updates (partial or full)."""
+    """Endpoint to handle AJAX updates (partial or full). A JSON list applies several edits at once."""
     data = request.get_json()
+    if isinstance(data, list):
+        if not all(isinstance(item, dict) and item.get('id') for item in data):
+            return jsonify({'status': 'error', 'message': 'Paper ID is required'}), 400
+        try:
+            return jsonify(update_papers_bulk(data, changed_by="user"))
+        except ValueError as e: # An edit with fields that cannot be stored; the whole batch is rolled back
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        except Exception as e:
+            print(f"Error updating {len(data)} papers: {e}") # Log error
+            return jsonify({'status': 'error', 'message': 'Failed to update database'}), 500
     paper_id = data.get('id')
     if not paper_id:
         return jsonify({'status': 'error', 'message': 'Paper ID is required'}), 400
@@ -809,6 +867,8 @@ def update_paper():
         result = update_paper_custom_fields(paper_id, data, changed_by="user")
         # The result dict already contains status and other data
         return jsonify(result)
+    except ValueError as e: # Fields that cannot be stored
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         print(f"Error updating paper {paper_id}: {e}") # Log error
         return jsonify({'status': 'error', 'message': 'Failed to update database'}), 500
@@ -922,6 +982,38 @@ def verify_paper():
         return jsonify({'status': 'error', 'message': 'Invalid mode or missing paper_id for single verification.'}), 400
 
 
+# Background BibTeX imports by job id: {'status': 'running' | 'success' | 'error', 'message': ..., 'finished': timestamp}
+import_jobs = {}
+import_jobs_lock = threading.Lock()
+IMPORT_JOB_TTL = 3600 # Seconds a finished job whose result was never polled is kept
+
+def finish_import_job(job_id, status, message):
+    with import_jobs_lock:
+        import_jobs[job_id] = {'status': status, 'message': message, 'finished': time.time()}
+
+def prune_import_jobs():
+    """Drops finished jobs nobody polled for within IMPORT_JOB_TTL (e.g. the browser tab was closed)."""
+    cutoff = time.time() - IMPORT_JOB_TTL
+    with import_jobs_lock:
+        for job_id in [k for k, job in import_jobs.items() if job['status'] != 'running' and job['finished'] < cutoff]:
+            del import_jobs[job_id]
+
+def run_import_task(job_id, bib_path, db_file):
+    """Background task importing an uploaded BibTeX file, then deleting it."""
+    try:
+        # Import here to avoid potential circular imports if placed at the top
+        import import_bibtex
+        import_bibtex.import_bibtex(bib_path, db_file)
+        finish_import_job(job_id, 'success', 'BibTeX file imported successfully.')
+    except Exception as e:
+        print(f"Error importing BibTeX: {e}")
+        finish_import_job(job_id, 'error', f'Import failed: {str(e)}')
+    finally:
+        try:
+            os.unlink(bib_path)
+        except OSError:
+            pass # Ignore errors during cleanup
+
 @app.route('/upload_bibtex', methods=['POST'])
 def upload_bibtex():
     """Endpoint to handle BibTeX file upload and import."""
@@ -937,91 +1029,84 @@ def upload_bibtex():
 
     if file and file.filename.lower().endswith('.bib'):
         try:
-            # Save the uploaded file to a temporary location
+            # Copy the upload (already received by werkzeug) to a temporary file in 1 MB chunks
             with tempfile.NamedTemporaryFile(delete=False, suffix='.bib') as tmp_bib_file:
-                file.save(tmp_bib_file.name)
+                shutil.copyfileobj(file.stream, tmp_bib_file, length=1 << 20)
                 tmp_bib_path = tmp_bib_file.name
-
-            # Use the existing import_bibtex logic
-            # Import here to avoid potential circular imports if placed at the top
-            import import_bibtex 
-
-            # Call the import function with the temporary file and the global DB path
-            import_bibtex.import_bibtex(tmp_bib_path, DATABASE)
-
-            # Clean up the temporary file
-            os.unlink(tmp_bib_path)
-
-            return jsonify({'status': 'success', 'message': 'BibTeX file imported successfully.'})
-
         except Exception as e:
-            # Ensure cleanup even if import fails
-            if 'tmp_bib_path' in locals():
-                try:
-                    os.unlink(tmp_bib_path)
-                except OSError:
-                    pass # Ignore errors during cleanup
-            print(f"Error importing BibTeX: {e}")
-            return jsonify({'status': 'error', 'message': f'Import failed: {str(e)}'}), 500
+            print(f"Error saving BibTeX upload: {e}")
+            return jsonify({'status': 'error', 'message': f'Upload failed: {str(e)}'}), 500
+
+        # Import in a background thread, like batch classification; the client polls /import_status
+        prune_import_jobs()
+        job_id = uuid.uuid4().hex
+        with import_jobs_lock:
+            import_jobs[job_id] = {'status': 'running', 'message': f"Importing '{file.filename}'..."}
+        thread = threading.Thread(target=run_import_task, args=(job_id, tmp_bib_path, DATABASE))
+        thread.daemon = True # Dies with main process
+        thread.start()
+        return jsonify({'status': 'started', 'job_id': job_id, 'message': f"Import of '{file.filename}' initiated."})
     else:
         return jsonify({'status': 'error', 'message': 'Invalid file type. Please upload a .bib file.'}), 400
 
+@app.route('/import_status/<job_id>', methods=['GET'])
+def import_status(job_id):
+    """Endpoint reporting a background BibTeX import: 'running', then 'success' or 'error' (reported once)."""
+    with import_jobs_lock:
+        job = import_jobs.get(job_id)
+        if job is not None and job['status'] != 'running':
+            del import_jobs[job_id] # Finished jobs are dropped once their result has been read
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown import job'}), 404
+    return jsonify({'status': job['status'], 'message': job['message']})
+
 
 
 # --- Jinja2-like filters ---
+# Renderings of the common values, built once as Markup; only model names are formatted per call.
+# 1/0 hash and compare equal to True/False, so they share the entries.
+STATUS_SYMBOLS = {True: Markup('✔️'), False: Markup('❌')} # Checkmark for True, cross for False
+UNKNOWN_STATUS = Markup('❔') # Question mark for Unknown/Null
+USER_SPAN = Markup('<span title="User">👤</span>') # Human emoji
+VERIFIED_BY_SPANS = {'user': USER_SPAN, None: Markup('<span title="Unverified">❔</span>')}
+VERIFIED_BY_SPANS[''] = VERIFIED_BY_SPANS[None]
+CHANGED_BY_SPANS = {'user': USER_SPAN, None: Markup('<span title="Unknown">❔</span>')} # Question mark for null/empty
+CHANGED_BY_SPANS[''] = CHANGED_BY_SPANS[None]
+
+@app.template_filter('render_status')
 def render_status(value):
     """Render status value as emoji/symbol"""
-    if value == 1 or value is True:
-        return '✔️' # Checkmark for True
-    elif value == 0 or value is False:
-        return '❌' # Cross for False
-    else: # None or unknown
-        return '❔' # Question mark for Unknown/Null
+    try:
+        return STATUS_SYMBOLS.get(value, UNKNOWN_STATUS)
+    except TypeError: # Unhashable (malformed) values are unknown too
+        return UNKNOWN_STATUS
+
+def render_model_span(value):
+    """Model name as a computer emoji with the name as tooltip."""
+    # Markup's % escapes the model name (quotes, <, > and &) with markupsafe for HTML attribute safety
+    return Markup('<span title="%s">🖥️</span>') % str(value)
 
+@app.template_filter('render_verified_by')
 def render_verified_by(value):
     """
     Render verified_by value as emoji.
     Accepts the raw database value.
-    Returns HTML string with emoji and tooltip if needed.
+    Returns Markup with emoji and tooltip if needed.
     """
-    if value == 'user':
-        return f'<span title="User">👤</span>' # Human emoji
-    elif value is None or value == '':
-        return f'<span title="Unverified">❔</span>'
-    else:
-        # For any other string, value is a model name, show computer emoji with tooltip
-        # Escape the model name for HTML attribute safety
-        escaped_model_name = str(value).replace('"', '&quot;').replace("'", "&#39;")
-        return f'<span title="{escaped_model_name}">🖥️</span>'
+    span = VERIFIED_BY_SPANS.get(value)
+    # For any other string, value is a model name, show computer emoji with tooltip
+    return span if span is not None else render_model_span(value)
 
+@app.template_filter('render_changed_by')
 def render_changed_by(value):
     """
     Render changed_by value as emoji.
     Accepts the raw database value.
-    Returns HTML string with emoji and tooltip if needed.
+    Returns Markup with emoji and tooltip if needed.
     """
-    if value == 'user':
-        return f'<span title="User">👤</span>' # Human emoji
-    elif value is None or value == '':
-        return f'<span title="Unknown">❔</span>' # Question mark for null/empty
-    else:
-        # For any other string, value is a model name, show computer emoji with tooltip
-        escaped_model_name = str(value).replace('"', '&quot;').replace("'", "&#39;")
-        return f'<span title="{escaped_model_name}">🖥️</span>'
-
-@app.template_filter('render_changed_by')
-def render_changed_by_filter(value):
-    # Use Markup to tell Jinja2 that the output is safe HTML
-    return Markup(render_changed_by(value))
-
-@app.template_filter('render_status')
-def render_status_filter(value):
-    return render_status(value)
-
-@app.template_filter('render_verified_by')
-def render_verified_by_filter(value):
-    # Use Markup to tell Jinja2 that the output is safe HTML
-    return Markup(render_verified_by(value)) 
+    span = CHANGED_BY_SPANS.get(value)
+    # For any other string, value is a model name, show computer emoji with tooltip
+    return span if span is not None else render_model_span(value)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Browse and edit PCB inspection papers database.')
@@ -1051,6 +1136,7 @@ if __name__ == '__main__':
         if not cursor.fetchone():
             print(f"Error: Database '{DATABASE}' does not contain required 'papers' table")
             sys.exit(1)
+        SEARCH_INDEX_AVAILABLE = globals.ensure_indexes(conn) # Builds the filter and search indexes on first run
         conn.close()
     except sqlite3.Error as e:
         print(f"Error verifying database: {e}")
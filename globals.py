@@ -3,20 +3,57 @@
 # See DEFAULT_FEATURES and DEFAULT_TECHNIQUE below. ****
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ReadTimeoutError
+import orjson
 import sqlite3
 
 import threading
+import queue
+import string
 import os
+import time
+import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 LLM_SERVER_URL = "http://localhost:8080"
 
 MAX_CONCURRENT_WORKERS = 8 # Match your server slots
+DB_WRITE_BATCH_SIZE = 32 # Max papers committed per transaction by the DB writer thread
+DB_WRITE_BATCH_TIMEOUT = 1.0 # Seconds the writer waits to fill a batch before committing
+DB_WRITE_BATCH_ATTEMPTS = 3 # Tries per batch if the database stays locked past busy_timeout
+LLM_CONNECT_TIMEOUT = 10 # Seconds to establish a connection to the LLM server
+LLM_READ_TIMEOUT = 600 # Max seconds between streamed chunks of an LLM response
+LLM_REQUEST_ATTEMPTS = 3 # Tries per paper before send_prompt_to_llm gives up on it
+LLM_RETRY_BACKOFF = 5 # Seconds before the second try, doubling after that
+LLM_RETRY_BUDGET = 300 # Max seconds since a paper's first try within which send_prompt_to_llm still retries it
 DATABASE_FILE = "new.sqlite"
 GRAMMAR_FILE = "" #"output.gbnf" #disabled for reasoning models.
 PROMPT_TEMPLATE = "prompt_template.txt"
 VERIFIER_TEMPLATE = "verifier_template.txt"
 
+# --- Shared HTTP session for LLM requests ---
+# A single Session keeps one keep-alive socket per worker in urllib3's pool,
+# so each paper doesn't pay a fresh TCP handshake to the LLM server.
+# Transient failures (connection refused, 429/5xx while the server is busy or loading a model)
+# are retried with backoff; read errors are not, so a timed-out generation is never replayed
+# (send_prompt_to_llm's own retries skip read timeouts too).
+LLM_RETRY_STATUSES = (429, 500, 502, 503, 504)
+SESSION = requests.Session()
+_retry = Retry(
+    total=3,
+    read=0,
+    backoff_factor=0.5,
+    status_forcelist=LLM_RETRY_STATUSES,
+    allowed_methods=frozenset({"HEAD", "GET", "POST"}),
+    raise_on_status=False # Hand the last response back so raise_for_status() reports it
+)
+_adapter = HTTPAdapter(pool_connections=MAX_CONCURRENT_WORKERS, pool_maxsize=MAX_CONCURRENT_WORKERS, max_retries=_retry)
+SESSION.mount("http://", _adapter)
+SESSION.mount("https://", _adapter)
+
 # Define default JSON structures for features and technique
 DEFAULT_FEATURES = {
     "tracks": None,
@@ -60,29 +97,30 @@ TYPE_EMOJIS = {
 # Default emoji for unknown types
 DEFAULT_TYPE_EMOJI = '📄' # Using article as default
 
-# --- Global Shutdown Flag for Instant Shutdown (using Lock for atomicity) ---
+# --- Global Shutdown Flag for Instant Shutdown (threading.Event, so checks take no lock) ---
 # This provides a common mechanism for scripts to handle Ctrl+C gracefully.
-shutdown_lock = threading.Lock()
-shutdown_flag = False
+shutdown_event = threading.Event()
 
 def set_shutdown_flag():
-    """Sets the global shutdown flag to True in a thread-safe manner."""
-    global shutdown_flag
-    with shutdown_lock:
-        shutdown_flag = True
+    """Sets the global shutdown flag."""
+    shutdown_event.set()
 
 def is_shutdown_flag_set():
-    """Checks the global shutdown flag in a thread-safe manner."""
-    global shutdown_flag
-    with shutdown_lock:
-        return shutdown_flag
+    """Checks the global shutdown flag."""
+    return shutdown_event.is_set()
 
 def signal_handler(sig, frame):
-    """Standard signal handler for SIGINT (Ctrl+C). Sets shutdown flag and forces exit."""
-    print("\nReceived Ctrl+C. Killing all threads...")
+    """
+    Standard signal handler for SIGINT (Ctrl+C). The first Ctrl+C sets the shutdown flag:
+    workers drop their LLM streams, pending results are written and the database closes cleanly.
+    A second Ctrl+C forces exit.
+    """
+    if is_shutdown_flag_set():
+        print("\nReceived Ctrl+C again. Killing all threads...")
+        # Use os._exit for immediate shutdown across all threads
+        os._exit(1)
+    print("\nReceived Ctrl+C. Stopping workers (press Ctrl+C again to force exit)...")
     set_shutdown_flag()
-    # Use os._exit for immediate shutdown across all threads
-    os._exit(1)
     
 #usados por automate and verify:
 def get_model_alias(server_url_base):
@@ -91,9 +129,9 @@ def get_model_alias(server_url_base):
     headers = {"Content-Type": "application/json"}
 
     try:
-        response = requests.get(models_url, headers=headers, timeout=30)
+        response = SESSION.get(models_url, headers=headers, timeout=30)
         response.raise_for_status()
-        models_data = response.json()
+        models_data = orjson.loads(response.content)
 
         # Simplified model alias detection
         if models_data and isinstance(models_data.get('data'), list) and models_data['data']:
@@ -106,7 +144,7 @@ def get_model_alias(server_url_base):
         print(f"Error connecting to LLM server: {e}")
         if hasattr(e, 'response') and e.response:
             print(f"Response Text: {e.response.text}")
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"Error decoding JSON response: {e}")
         if 'response' in locals():
             print(f"Response Text: {response.text}")
@@ -115,6 +153,21 @@ def get_model_alias(server_url_base):
     print(f"Using fallback model alias: '{fallback_alias}'")
     return fallback_alias
 
+def prewarm_connections(server_url_base=None):
+    """Opens one keep-alive connection per worker slot so the first wave of requests reuses them."""
+    if server_url_base is None:
+        server_url_base = LLM_SERVER_URL
+
+    def _head(_):
+        try:
+            SESSION.head(server_url_base, timeout=5)
+        except requests.exceptions.RequestException:
+            pass # Server not reachable yet; workers will connect on demand.
+
+    # Issue the HEADs concurrently so each one lands on its own socket in the pool.
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_WORKERS) as executor:
+        list(executor.map(_head, range(MAX_CONCURRENT_WORKERS)))
+
 def load_prompt_template(template_path):
     """Loads the prompt template from a file."""
     try:
@@ -127,16 +180,219 @@ def load_prompt_template(template_path):
         print(f"Error reading prompt template file '{template_path}': {e}")
         raise
 
+def split_prompt_template(template_content):
+    """
+    Splits a prompt template into its static instruction prefix (already unescaped)
+    and the paper-specific tail, so only the tail needs .format() for each paper.
+    Returns (prefix, tail_template).
+    """
+    prefix_parts = []
+    tail_parts = []
+    for literal_text, field_name, format_spec, conversion in string.Formatter().parse(template_content):
+        if not tail_parts and field_name is None:
+            prefix_parts.append(literal_text)
+            continue
+        if not tail_parts:
+            # First placeholder: its literal text is still part of the static prefix
+            prefix_parts.append(literal_text)
+            literal_text = ''
+        # Re-escape literal braces so the tail remains a valid format string
+        tail_parts.append(literal_text.replace('{', '{{').replace('}', '}}'))
+        if field_name is not None:
+            conversion_str = f"!{conversion}" if conversion else ""
+            spec_str = f":{format_spec}" if format_spec else ""
+            tail_parts.append(f"{{{field_name}{conversion_str}{spec_str}}}")
+    return ''.join(prefix_parts), ''.join(tail_parts)
+
+
+# --- Per-thread SQLite connections ---
+# Workers reuse one connection each instead of connecting per call. Connections
+# are tracked with their owning thread so ones left behind by finished threads
+# can be closed, and everything still open is closed at exit.
+_db_local = threading.local()
+_db_connections = [] # (thread, connection) pairs
+_db_connections_lock = threading.Lock()
+
+def open_db(db_path):
+    """
+    Opens a tuned connection to db_path in autocommit mode (callers that need a
+    transaction issue BEGIN themselves). WAL lets readers run alongside the writer.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL") # Persistent in the file; a no-op once set
+    conn.execute("PRAGMA synchronous=NORMAL") # One fsync per commit (at checkpoint) in WAL mode
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000") # ~64 MB page cache
+    conn.execute("PRAGMA mmap_size=268435456") # Reads up to 256 MB straight from the mapped file
+    # SQLite's advice for long-lived connections: a bounded optimize at open (0x10000: check every table,
+    # 0x02: cap analysis work), plus the plain PRAGMA optimize run at exit in close_db_connections
+    conn.execute("PRAGMA optimize=0x10002")
+    return conn
+
+def get_db_connection(db_path):
+    """Returns this thread's connection to db_path, opened with open_db on first use."""
+    connections = getattr(_db_local, 'connections', None)
+    if connections is None:
+        connections = _db_local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = open_db(db_path)
+        conn.row_factory = sqlite3.Row
+        connections[db_path] = conn
+        with _db_connections_lock:
+            # Close connections whose threads have already exited
+            for thread, stale_conn in [entry for entry in _db_connections if not entry[0].is_alive()]:
+                stale_conn.close()
+            _db_connections[:] = [entry for entry in _db_connections if entry[0].is_alive()]
+            _db_connections.append((threading.current_thread(), conn))
+    return conn
+
+@atexit.register
+def close_db_connections():
+    """Closes every per-thread connection opened through get_db_connection."""
+    with _db_connections_lock:
+        for _, conn in _db_connections:
+            try:
+                conn.execute("PRAGMA optimize") # Refreshes planner stats for the queries this connection ran
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)") # Leave no WAL to replay on the next open
+            except sqlite3.Error:
+                pass
+            conn.close()
+        _db_connections.clear()
 
-def get_paper_by_id(db_path, paper_id):
-    """Fetches a single paper's data from the database by its ID."""
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM papers WHERE id = ?", (paper_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+def ensure_indexes(conn):
+    """Creates the indexes behind the 'remaining' scans and the browser's filters and search, if missing.
+       Returns whether the full-text search index is available (see ensure_search_index)."""
+    # Each matches its 'remaining' predicate exactly so SQLite can use it; processed rows drop out of it
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_unclassified ON papers(id) WHERE changed_by IS NULL OR changed_by = ''")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_unverified ON papers(id) "
+                 "WHERE (changed_by IS NOT NULL AND changed_by != '') AND (verified_by IS NULL OR verified_by = '')")
+    # The browser's default filter: is_offtopic = 0 and IS NULL each become a seek on the year range
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_papers_filter ON papers(is_offtopic, year, page_count)")
+    # Expression indexes for the browser's feature filters, which use these exact json_extract() forms
+    for key in DEFAULT_FEATURES:
+        if key != 'other':
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_features_{key} ON papers(json_extract(features, '$.{key}'))")
+    return ensure_search_index(conn)
+
+# Columns mirrored into the papers_fts full-text index searched by the browser
+SEARCH_COLUMNS = (
+    'id', 'type', 'title', 'authors', 'month', 'journal', 'volume', 'pages', 'doi', 'issn',
+    'abstract', 'keywords', 'research_area', 'user_trace', 'features', 'technique'
+)
+
+def ensure_search_index(conn):
+    """Creates the papers_fts index and the triggers keeping it in sync with papers, if missing.
+       Returns False if this SQLite build lacks FTS5, in which case searches fall back to LIKE."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'papers_fts'").fetchone():
+        return True
+    cols = ", ".join(SEARCH_COLUMNS)
+    new_cols = ", ".join(f"new.{c}" for c in SEARCH_COLUMNS)
+    old_cols = ", ".join(f"old.{c}" for c in SEARCH_COLUMNS)
+    try:
+        with conn:
+            # External-content table: stores only the index, rows are read back from papers.
+            # The trigram tokenizer keeps the case-insensitive substring semantics of the old LIKE search.
+            conn.execute(f"CREATE VIRTUAL TABLE papers_fts USING fts5({cols}, content='papers', content_rowid='rowid', "
+                         "tokenize='trigram')")
+            conn.execute(f"CREATE TRIGGER papers_fts_ai AFTER INSERT ON papers BEGIN "
+                         f"INSERT INTO papers_fts(rowid, {cols}) VALUES (new.rowid, {new_cols}); END")
+            conn.execute(f"CREATE TRIGGER papers_fts_ad AFTER DELETE ON papers BEGIN "
+                         f"INSERT INTO papers_fts(papers_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols}); END")
+            conn.execute(f"CREATE TRIGGER papers_fts_au AFTER UPDATE OF {cols} ON papers BEGIN "
+                         f"INSERT INTO papers_fts(papers_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols}); "
+                         f"INSERT INTO papers_fts(rowid, {cols}) VALUES (new.rowid, {new_cols}); END")
+            conn.execute("INSERT INTO papers_fts(papers_fts) VALUES ('rebuild')") # Index rows already in the table
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search index unavailable, searches will scan the table: {e}")
+        return False
+    return True
+
+# Appended to the producer's query: generation time grows with prompt length, so dispatching the
+# longest papers first keeps a few slow stragglers from running alone at the end of a run
+LONGEST_FIRST_ORDER = " ORDER BY COALESCE(length(title), 0) + COALESCE(length(abstract), 0) DESC"
+
+def paper_producer(db_path, paper_query, paper_params, paper_queue, num_workers):
+    """Streams paper rows from the database into the queue, then adds one poison pill per worker."""
+    conn = get_db_connection(db_path)
+    try:
+        # Iterating the cursor fetches rows as they are consumed, never the whole table at once
+        for row in conn.execute(paper_query, paper_params):
+            paper = dict(row)
+            # Bounded queue: retry the put so a shutdown is noticed even if workers stopped consuming
+            while True:
+                if is_shutdown_flag_set():
+                    return
+                try:
+                    paper_queue.put(paper, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+    except Exception as e:
+        print(f"[Producer] Error reading papers: {e}")
+    # Add poison pills for each worker thread
+    for _ in range(num_workers):
+        paper_queue.put(None)
+
+def put_result(results_queue, item, writer=None):
+    """
+    Puts item on a DB writer thread's bounded queue without hanging if that writer has died.
+    While the queue stays full, gives up (returning False) once `writer` has exited or, for
+    callers without the thread, once the shutdown flag is set (a failed writer sets it).
+    """
+    while True:
+        try:
+            results_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            writer_gone = not writer.is_alive() if writer is not None else is_shutdown_flag_set()
+            if writer_gone:
+                return False
+
+def iter_result_batches(results_queue):
+    """
+    Yields lists of queued results for a single writer thread: up to DB_WRITE_BATCH_SIZE items,
+    or whatever arrived within DB_WRITE_BATCH_TIMEOUT of the first one. Stops on a None sentinel.
+    """
+    done = False
+    while not done:
+        item = results_queue.get()
+        if item is None:
+            return
+        batch = [item]
+        # Keep collecting until the batch is full or has waited long enough
+        deadline = time.monotonic() + DB_WRITE_BATCH_TIMEOUT
+        while len(batch) < DB_WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = results_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        yield batch
+
+def execute_batch(conn, query, rows):
+    """
+    Runs query once per row in a single BEGIN IMMEDIATE transaction and returns the rows changed.
+    The whole batch is retried if the database is still locked after busy_timeout.
+    """
+    for attempt in range(1, DB_WRITE_BATCH_ATTEMPTS + 1):
+        try:
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.executemany(query, rows)
+                return cursor.rowcount
+        except sqlite3.OperationalError as e:
+            if attempt == DB_WRITE_BATCH_ATTEMPTS or 'locked' not in str(e):
+                raise
+            print(f"[DB Writer] Database locked, retrying batch of {len(rows)} ({attempt}/{DB_WRITE_BATCH_ATTEMPTS})...")
 
 
 def load_grammar(grammar_path):
@@ -151,65 +407,108 @@ def load_grammar(grammar_path):
         print(f"Error reading grammar file '{grammar_path}': {e}")
         raise
 
-def send_prompt_to_llm(prompt_text, grammar_text=None, server_url_base=None, model_name="default", is_verification=False):
+# Same for every chat completion request; the body is pre-encoded bytes, so the type is set explicitly
+LLM_REQUEST_HEADERS = {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+@functools.lru_cache(maxsize=8)
+def _request_body_prefix(model_name, grammar_text):
     """
-    Sends a prompt to the LLM via the OpenAI-compatible API. 
-    Returns (content_str, model_name_used, reasoning_trace).
+    Encodes the parts of the chat completion body that are the same for every paper (sampling
+    parameters and the possibly multi-KB grammar) once per run. Returns bytes that only need
+    the JSON-encoded prompt and the closing brackets appended.
     """
-    if server_url_base is None:
-        server_url_base = LLM_SERVER_URL  # Now this will work
-    
-    chat_url = f"{server_url_base.rstrip('/')}/v1/chat/completions"
-    headers = {"Content-Type": "application/json"}
     payload = { #official recommended parameters from Qwen:
         "model": model_name,
-        "messages": [{"role": "user", "content": prompt_text}],
         "temperature": 0.6,
         "top_p": 0.95, 
         "top_k": 20, 
         "min_p": 0,
         "max_tokens": 32768,
-        "stream": False
+        "stream": True
     }
     if grammar_text:
         payload["grammar"] = grammar_text
+    return orjson.dumps(payload)[:-1] + b',"messages":[{"role":"user","content":'
+
+def send_prompt_to_llm(prompt_text, grammar_text=None, server_url_base=None, model_name="default", is_verification=False):
+    """
+    Sends a prompt to the LLM via the OpenAI-compatible API. 
+    Returns (content_str, model_name_used, reasoning_trace).
+    """
+    if server_url_base is None:
+        server_url_base = LLM_SERVER_URL  # Now this will work
+    
+    chat_url = f"{server_url_base.rstrip('/')}/v1/chat/completions"
+    # Only the prompt is encoded per request; everything else comes pre-encoded
+    body = _request_body_prefix(model_name, grammar_text) + orjson.dumps(prompt_text) + b'}]}'
     
     context = "verification " if is_verification else ""
     
-    try:
-        if is_shutdown_flag_set():
-            return None, None, None
-        response = requests.post(chat_url, headers=headers, json=payload, timeout=600)
-        if is_shutdown_flag_set():
-            return None, None, None
-        response.raise_for_status()
-        response_data = response.json()
-        
-        model_name_from_response = response_data.get('model', model_name)
-        if 'choices' in response_data and response_data['choices']:
-            # Extract reasoning_content safely
-            reasoning_content = None
-            message = response_data['choices'][0]['message']
-            if 'reasoning_content' in message:
-                reasoning_content = message.get('reasoning_content', '').strip()
-            content = message.get('content', '').strip()
-            return content, model_name_from_response, reasoning_content
-        else:
-            print(f"Warning: Unexpected LLM {context}response structure: {response_data}")
-            return None, model_name_from_response, None
-    except requests.exceptions.RequestException as e:
-        if is_shutdown_flag_set():
+    started = time.monotonic()
+    for attempt in range(1, LLM_REQUEST_ATTEMPTS + 1):
+        try:
+            if is_shutdown_flag_set():
+                return None, None, None
+            # Sent as bytes, bypassing requests' stdlib json encoder.
+            # The reply is streamed (SSE) so long reasoning runs never sit idle past the read timeout
+            # and the connection goes back to the pool as soon as the body ends.
+            with SESSION.post(chat_url, headers=LLM_REQUEST_HEADERS, data=body,
+                              timeout=(LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT), stream=True) as response:
+                if is_shutdown_flag_set():
+                    return None, None, None
+                response.raise_for_status()
+                model_name_from_response = model_name
+                content_parts = []
+                reasoning_parts = []
+                got_choices = False
+                for line in response.iter_lines():
+                    if is_shutdown_flag_set():
+                        return None, None, None
+                    if not line.startswith(b"data:"):
+                        continue # Blank separators and SSE comments
+                    chunk = line[5:].strip()
+                    if chunk == b"[DONE]":
+                        continue # Read on to the end of the body so the connection can be reused
+                    chunk = orjson.loads(chunk)
+                    if 'error' in chunk:
+                        print(f"Error from LLM server during {context}stream: {chunk['error']}")
+                        return None, None, None
+                    model_name_from_response = chunk.get('model', model_name_from_response)
+                    if not chunk.get('choices'):
+                        continue
+                    got_choices = True
+                    delta = chunk['choices'][0].get('delta') or {}
+                    if delta.get('reasoning_content'):
+                        reasoning_parts.append(delta['reasoning_content'])
+                    if delta.get('content'):
+                        content_parts.append(delta['content'])
+
+            if not got_choices:
+                print(f"Warning: Unexpected LLM {context}response structure: stream had no choices")
+                return None, model_name_from_response, None
+            reasoning_content = ''.join(reasoning_parts).strip() if reasoning_parts else None
+            return ''.join(content_parts).strip(), model_name_from_response, reasoning_content
+        except requests.exceptions.RequestException as e:
+            if is_shutdown_flag_set():
+                return None, None, None
+            print(f"Error sending {context}request to LLM server: {e}")
+            if hasattr(e, 'response') and e.response:
+                print(f"Response Text: {e.response.text}")
+            # Dropped streams and 429/5xx that outlasted the session's quick retries are worth another
+            # try after a longer pause (e.g. server restarting); other HTTP errors won't change.
+            # Read timeouts (raised mid-stream as a ConnectionError wrapping ReadTimeoutError) are not
+            # retried: the generation already ran for LLM_READ_TIMEOUT and would likely stall again.
+            read_timed_out = isinstance(e, requests.exceptions.ReadTimeout) or (
+                isinstance(e, requests.exceptions.ConnectionError) and e.args and isinstance(e.args[0], ReadTimeoutError))
+            retryable = not read_timed_out and (not isinstance(e, requests.exceptions.HTTPError) or (
+                e.response is not None and e.response.status_code in LLM_RETRY_STATUSES))
+            delay = LLM_RETRY_BACKOFF * 2 ** (attempt - 1)
+            if retryable and attempt < LLM_REQUEST_ATTEMPTS and time.monotonic() - started + delay <= LLM_RETRY_BUDGET:
+                print(f"Retrying {context}request in {delay}s (attempt {attempt + 1}/{LLM_REQUEST_ATTEMPTS})...")
+                shutdown_event.wait(delay)
+                continue
             return None, None, None
-        print(f"Error sending {context}request to LLM server: {e}")
-        if hasattr(e, 'response') and e.response:
-            print(f"Response Text: {e.response.text}")
-        return None, None, None
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSON {context}response: {e}")
-        if 'response' in locals():
-            print(f"Response Text: {response.text}")
-        return None, None, None
-    except KeyError as e:
-        print(f"Unexpected {context}response structure, missing key: {e}")
-        print(f"Response Data: {response_data}")
-        return None, None, None
\ No newline at end of file
+        except orjson.JSONDecodeError as e:
+            print(f"Error decoding JSON {context}response: {e}")
+            print(f"Response Line: {line}")
+            return None, None, None
\ No newline at end of file
@@ -52,6 +52,7 @@ def create_database(db_path):
         user_trace TEXT                     -- User comments.
     )
     ''')
+    globals.ensure_indexes(conn)
     # Enable WAL mode for better concurrency (optional)
     cursor.execute('PRAGMA journal_mode = WAL')
     conn.commit()
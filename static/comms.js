@@ -419,6 +419,25 @@ document.addEventListener('DOMContentLoaded', function () {
     const bibtexFileInput = document.getElementById('bibtex-file-input');
     // const batchStatusMessage = document.getElementById('batch-status-message'); // Reuse existing status element
 
+    // Polls a background import until it finishes; resolves with its final status
+    function waitForImport(jobId) {
+        return new Promise((resolve, reject) => {
+            const poll = () => {
+                fetch(`/import_status/${encodeURIComponent(jobId)}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        if (data.status === 'running') {
+                            setTimeout(poll, 1000);
+                        } else {
+                            resolve(data);
+                        }
+                    })
+                    .catch(reject);
+            };
+            setTimeout(poll, 500);
+        });
+    }
+
     if (importBibtexBtn && bibtexFileInput) {
         // Clicking the button triggers the hidden file input
         importBibtexBtn.addEventListener('click', () => {
@@ -466,6 +485,8 @@ document.addEventListener('DOMContentLoaded', function () {
                     }
                     return response.json();
                 })
+                // The import itself runs in the background; wait for its final status
+                .then(data => data.status === 'started' ? waitForImport(data.job_id) : data)
                 .then(data => {
                     if (data.status === 'success') {
                         console.log(data.message);
@@ -1,18 +1,29 @@
 # verify_classification.py
 # This should be agnostic to changes inside features and techniques:
-import sqlite3
-import json
+import orjson
 import argparse
 import time
 import os
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
 import queue
 import threading
 import signal
+import itertools
 import globals  # Import for global settings and shared functions
 
-def build_verification_prompt(paper_data, classification_data, template_content):
-    """Builds the verification prompt string for a single paper using a loaded template."""
+PROGRESS_REPORT_INTERVAL = 10 # Print progress every N papers
+
+# Columns read by build_verification_prompt; fetched in one query instead of once per paper
+VERIFY_COLUMNS = ("id, title, abstract, keywords, authors, year, type, journal, relevance, research_area, "
+                  "is_survey, is_offtopic, is_through_hole, is_smt, is_x_ray, features, technique")
+
+MAIN_BOOL_FIELDS = ('is_survey', 'is_offtopic', 'is_through_hole', 'is_smt', 'is_x_ray')
+# DB integers back to booleans for prompt clarity; NULL or anything unexpected becomes None
+DB_TO_BOOL = {1: True, 0: False}
+
+def build_verification_prompt(paper_data, classification_data, template_parts):
+    """Builds the verification prompt string for a single paper using a template split by globals.split_prompt_template."""
+    prefix, tail_template = template_parts
     # Prepare data for insertion into the template
     # Include original paper data
     format_data = {
@@ -30,27 +41,28 @@ def build_verification_prompt(paper_data, classification_data, template_content)
     # Convert complex fields (features, technique) back to JSON strings for template insertion
     classification_for_template = classification_data.copy()
     if isinstance(classification_for_template.get('features'), dict):
-        classification_for_template['features'] = json.dumps(classification_for_template['features'], indent=2)
+        classification_for_template['features'] = orjson.dumps(classification_for_template['features'], option=orjson.OPT_INDENT_2).decode()
     if isinstance(classification_for_template.get('technique'), dict):
-        classification_for_template['technique'] = json.dumps(classification_for_template['technique'], indent=2)
+        classification_for_template['technique'] = orjson.dumps(classification_for_template['technique'], option=orjson.OPT_INDENT_2).decode()
         
     # Add classification fields to format data
     format_data.update(classification_for_template)
 
     try:
-        return template_content.format(**format_data)
+        return prefix + tail_template.format(**format_data)
     except KeyError as e:
         print(f"Error formatting verification prompt: Missing key {e} in paper/classification data or template expects it.")
         raise
 
-def update_paper_verification(db_path, paper_id, verification_result, verified_by="LLM", reasoning_trace=None):
-    """
-    Updates the verification fields (verified, estimated_score, verified_by, verifier_trace)
-    in the database for a specific paper.
-    Does NOT update 'changed' or 'changed_by' as per requirements.
-    """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+# Fixed statement so SQLite reuses one prepared statement; a None trace keeps the stored verifier_trace
+# Verification never touches 'changed'/'changed_by', which record classification edits
+VERIFICATION_UPDATE_QUERY = (
+    "UPDATE papers SET verified = ?, estimated_score = ?, verified_by = ?, "
+    "verifier_trace = COALESCE(?, verifier_trace) WHERE id = ?"
+)
+
+def verification_update_params(paper_id, verification_result, verified_by="LLM", reasoning_trace=None):
+    """Builds the VERIFICATION_UPDATE_QUERY parameters for one paper's verification result."""
     verified = verification_result.get('verified')
     # Normalize verified value to database format (1, 0, None)
     if verified is True:
@@ -67,37 +79,39 @@ def update_paper_verification(db_path, paper_id, verification_result, verified_b
     else:
         estimated_score_db_value = None
 
-    # --- Prepare update fields and values ---
-    update_fields = ["verified = ?", "estimated_score = ?", "verified_by = ?"]
-    update_values = [verified_db_value, estimated_score_db_value, verified_by]
-
-    # --- Add verifier_trace if provided ---
-    if reasoning_trace is not None:
-        update_fields.append("verifier_trace = ?")
-        update_values.append(reasoning_trace)
-
-    # --- Construct and execute the query ---
-    update_query = f"UPDATE papers SET {', '.join(update_fields)} WHERE id = ?"
-    update_values.append(paper_id) # Add paper_id for the WHERE clause
+    return (verified_db_value, estimated_score_db_value, verified_by, reasoning_trace, paper_id)
 
+def verification_writer_worker(db_path, results_queue):
+    """
+    Single writer thread: drains verification results and commits them in batches
+    of up to globals.DB_WRITE_BATCH_SIZE papers per transaction. Stops on a None sentinel.
+    """
     try:
-        cursor.execute(update_query, update_values) # Pass the combined list of values
-        conn.commit()
-        rows_affected = cursor.rowcount
+        conn = globals.get_db_connection(db_path)
+        for batch in globals.iter_result_batches(results_queue):
+            try:
+                rows = [verification_update_params(*result) for result in batch]
+                updated_count = globals.execute_batch(conn, VERIFICATION_UPDATE_QUERY, rows)
+            except Exception as e:
+                print(f"[DB Writer] Error writing verification batch of {len(batch)} papers: {e}")
+                continue
+            for paper_id, _, model_name_used, _ in batch:
+                print(f"[DB Writer] Verified paper {paper_id} (Model: {model_name_used})")
+            if updated_count < len(batch):
+                # Only possible if papers were deleted while the run was in progress
+                print(f"[DB Writer] Warning: {len(batch) - updated_count} of {len(batch)} papers in batch were not found")
     except Exception as e:
-        print(f"[Thread-{threading.get_ident()}] Error updating verification for paper {paper_id}: {e}")
-        rows_affected = 0
-    finally:
-        conn.close()
-    return rows_affected > 0
+        # Nothing more can be saved (e.g. the database could not be opened), so stop the run
+        # instead of leaving workers to fill the queue
+        print(f"[DB Writer] Stopped: {e}")
+        globals.set_shutdown_flag()
 
 def process_paper_verification_worker(
-    db_path, 
     grammar_content, 
-    verification_prompt_template_content, 
-    paper_id_queue, 
-    progress_lock, 
-    processed_count, 
+    verification_prompt_template_parts, 
+    paper_queue, 
+    results_queue, 
+    processed_counter, 
     total_papers, 
     model_alias
 ):
@@ -105,7 +119,7 @@ def process_paper_verification_worker(
     while True:
         try:
             # Use timeout to periodically check for shutdown
-            paper_id = paper_id_queue.get(timeout=1)
+            paper_data = paper_queue.get(timeout=1)
         except queue.Empty:
             # Check if we should shutdown periodically
             if globals.is_shutdown_flag_set():
@@ -113,52 +127,41 @@ def process_paper_verification_worker(
             continue
 
         # Poison pill - time to die
-        if paper_id is None:
+        if paper_data is None:
             return
 
         # Check for shutdown before processing
         if globals.is_shutdown_flag_set():
             return
 
+        paper_id = paper_data['id']
         print(f"[Thread-{threading.get_ident()}] Verifying paper ID: {paper_id}")
         try:
-            # 1. Fetch paper data and current classification from DB
-            paper_data = globals.get_paper_by_id(db_path, paper_id)
-            if not paper_data:
-                print(f"[Thread-{threading.get_ident()}] Error: Paper {paper_id} not found in DB for verification.")
-                continue
-
+            # 1. Paper data and current classification were fetched up front by run_verification
             # Prepare classification data for the prompt
             # Parse JSON fields back into dicts for the prompt builder
-            classification_data = {}
-            bool_fields = ['is_survey', 'is_offtopic', 'is_through_hole', 'is_smt', 'is_x_ray']
-            for field in bool_fields:
-                 # Convert DB integers (1,0,None) back to boolean/None for prompt clarity
-                db_val = paper_data.get(field)
-                if db_val == 1:
-                    classification_data[field] = True
-                elif db_val == 0:
-                    classification_data[field] = False
-                else: # None or unexpected
-                    classification_data[field] = None
+            classification_data = {field: DB_TO_BOOL.get(paper_data.get(field)) for field in MAIN_BOOL_FIELDS}
 
             classification_data['research_area'] = paper_data.get('research_area')
 
             # Handle JSON fields
+            # Start from the defaults: keys merged to null by json_patch are absent from the stored JSON
             try:
-                classification_data['features'] = json.loads(paper_data.get('features', '{}')) if paper_data.get('features') else {}
-            except json.JSONDecodeError:
-                classification_data['features'] = {}
+                stored_features = orjson.loads(paper_data.get('features', '{}')) if paper_data.get('features') else {}
+            except orjson.JSONDecodeError:
+                stored_features = {}
                 print(f"[Thread-{threading.get_ident()}] Warning: Could not parse features JSON for {paper_id}")
+            classification_data['features'] = {**globals.DEFAULT_FEATURES, **stored_features}
 
             try:
-                classification_data['technique'] = json.loads(paper_data.get('technique', '{}')) if paper_data.get('technique') else {}
-            except json.JSONDecodeError:
-                classification_data['technique'] = {}
+                stored_technique = orjson.loads(paper_data.get('technique', '{}')) if paper_data.get('technique') else {}
+            except orjson.JSONDecodeError:
+                stored_technique = {}
                 print(f"[Thread-{threading.get_ident()}] Warning: Could not parse technique JSON for {paper_id}")
+            classification_data['technique'] = {**globals.DEFAULT_TECHNIQUE, **stored_technique}
 
             # 2. Build the verification prompt
-            prompt_text = build_verification_prompt(paper_data, classification_data, verification_prompt_template_content)
+            prompt_text = build_verification_prompt(paper_data, classification_data, verification_prompt_template_parts)
             
             if globals.is_shutdown_flag_set():
                 return
@@ -179,7 +182,7 @@ def process_paper_verification_worker(
             if json_result_str:
                 # print(f"[DEBUG] Raw LLM output for {paper_id}: {json_result_str}")
                 try:
-                    llm_verification_result = json.loads(json_result_str)
+                    llm_verification_result = orjson.loads(json_result_str)
                     # 5. Update database with verification result
                     # Prepend model info to reasoning_trace
                     if reasoning_trace:
@@ -187,22 +190,11 @@ def process_paper_verification_worker(
                     else:
                         reasoning_trace = f"As verified by {model_name_used}"
 
-                    success = update_paper_verification(
-                        db_path,
-                        paper_id,
-                        llm_verification_result,
-                        verified_by=model_name_used,
-                        reasoning_trace=reasoning_trace
-                    )
-                    if success:
-                        print(f"[Thread-{threading.get_ident()}] Verified paper {paper_id} (Model: {model_name_used})")
-                    else:
-                        print(f"[Thread-{threading.get_ident()}] No verification changes or error for paper {paper_id}")
-                except json.JSONDecodeError as e:
+                    # Hand the result to the DB writer thread, which commits in batches
+                    globals.put_result(results_queue, (paper_id, llm_verification_result, model_name_used, reasoning_trace))
+                except orjson.JSONDecodeError as e:
                     print(f"[Thread-{threading.get_ident()}] Error parsing LLM verification output for {paper_id}: {e}")
                     print(f"LLM Output: {json_result_str}")
-                except Exception as e:
-                    print(f"[Thread-{threading.get_ident()}] Error updating DB verification for {paper_id}: {e}")
             else:
                 if not globals.is_shutdown_flag_set():
                     print(f"[Thread-{threading.get_ident()}] No LLM verification response for {paper_id}")
@@ -213,9 +205,10 @@ def process_paper_verification_worker(
         finally:
             if globals.is_shutdown_flag_set():
                 return
-            with progress_lock:
-                processed_count[0] += 1
-                print(f"[Progress] Verified {processed_count[0]}/{total_papers} papers.")
+            # next() on itertools.count is atomic under the GIL, so no lock is needed
+            n = next(processed_counter)
+            if n % PROGRESS_REPORT_INTERVAL == 0 or n == total_papers:
+                print(f"[Progress] Verified {n}/{total_papers} papers.")
 
 def run_verification(mode='remaining', paper_id=None, db_file=None, grammar_file=None, prompt_template=None, server_url=None):
     """
@@ -244,6 +237,8 @@ def run_verification(mode='remaining', paper_id=None, db_file=None, grammar_file
 
     try:
         verification_prompt_template_content = globals.load_prompt_template(prompt_template)
+        # Split once so each paper only formats the short paper-specific tail
+        verification_prompt_template_parts = globals.split_prompt_template(verification_prompt_template_content)
         print(f"Loaded verification prompt template from '{prompt_template}'")
     except Exception as e:
         print(f"Error loading verification prompt template: {e}")
@@ -266,58 +261,66 @@ def run_verification(mode='remaining', paper_id=None, db_file=None, grammar_file
 
     print(f"Connecting to database '{db_file}' to fetch papers for verification...")
     try:
-        conn = sqlite3.connect(db_file)
+        conn = globals.open_db(db_file)
+        globals.ensure_indexes(conn) # Databases created before the index existed
         cursor = conn.cursor()
         
         if mode == 'all': #All classified papers (there's no sense in verifying classification of papers that weren't even classified)
             print("Fetching ALL classified papers for re-verification...")
-            cursor.execute("SELECT id FROM papers WHERE (changed_by IS NOT NULL AND changed_by != '')")
+            paper_query, paper_params = f"SELECT {VERIFY_COLUMNS} FROM papers WHERE (changed_by IS NOT NULL AND changed_by != '')", ()
         elif mode == 'id':
             if paper_id is None:
                 print("Error: Mode 'id' requires a specific paper ID.")
                 conn.close()
                 return False
             print(f"Fetching specific paper ID: {paper_id} for verification...")
-            cursor.execute("SELECT id FROM papers WHERE id = ?", (paper_id,))
-            if not cursor.fetchone():
-                 print(f"Warning: Paper ID {paper_id} not found or not classified.")
-                 conn.close()
-                 return True
-            cursor.execute("SELECT id FROM papers WHERE id = ?", (paper_id,))
+            paper_query, paper_params = f"SELECT {VERIFY_COLUMNS} FROM papers WHERE id = ?", (paper_id,)
         else: # Default to 'remaining'
             print("Fetching classified but unverified papers...")
-            cursor.execute("""
-                SELECT id 
+            paper_query, paper_params = f"""
+                SELECT {VERIFY_COLUMNS}
                 FROM papers 
                 WHERE (changed_by IS NOT NULL AND changed_by != '') 
                 AND (verified_by IS NULL OR verified_by = '')
-            """)
-            
-        paper_ids = [row[0] for row in cursor.fetchall()]
+            """, ()
+
+        # Only count here; the rows themselves are streamed to the workers by globals.paper_producer
+        cursor.execute(f"SELECT COUNT(*) FROM ({paper_query})", paper_params)
+        total_papers = cursor.fetchone()[0]
         conn.close()
-        total_papers = len(paper_ids)
+        if mode == 'id' and not total_papers:
+            print(f"Warning: Paper ID {paper_id} not found or not classified.")
+            return True
         print(f"Found {total_papers} paper(s) to verify based on mode '{mode}'.")
     except Exception as e:
-        print(f"Error fetching paper IDs: {e}")
+        print(f"Error fetching papers: {e}")
         return False
 
-    if not paper_ids:
+    if not total_papers:
         print("No papers found matching the verification criteria. Nothing to process.")
         return True
 
-    paper_id_queue = queue.Queue()
-    for pid in paper_ids:
-        paper_id_queue.put(pid)
+    # Bounded, so the producer stays only a few papers ahead of the workers
+    paper_queue = queue.Queue(maxsize=globals.MAX_CONCURRENT_WORKERS * 4)
+    producer = threading.Thread(
+        target=globals.paper_producer,
+        args=(db_file, paper_query + globals.LONGEST_FIRST_ORDER, paper_params, paper_queue, globals.MAX_CONCURRENT_WORKERS),
+        daemon=True
+    )
+
+    processed_counter = itertools.count(1)
 
-    # Add poison pills for each worker thread
-    for _ in range(globals.MAX_CONCURRENT_WORKERS):
-        paper_id_queue.put(None)
+    # Results are written by a single thread so workers never contend for the write lock
+    results_queue = queue.Queue(maxsize=256)
+    db_writer = threading.Thread(target=verification_writer_worker, args=(db_file, results_queue), daemon=True)
+    db_writer.start()
 
-    progress_lock = threading.Lock()
-    processed_count = [0]
+    # Seed the HTTP connection pool before the first wave of requests
+    globals.prewarm_connections(server_url)
 
     print(f"Starting ThreadPoolExecutor with {globals.MAX_CONCURRENT_WORKERS} workers for verification...")
     start_time = time.time()
+    producer.start()
 
     try:
         with ThreadPoolExecutor(max_workers=globals.MAX_CONCURRENT_WORKERS) as executor:
@@ -325,12 +328,11 @@ def run_verification(mode='remaining', paper_id=None, db_file=None, grammar_file
             for _ in range(globals.MAX_CONCURRENT_WORKERS):
                 future = executor.submit(
                     process_paper_verification_worker,
-                    db_file,
                     grammar_content,
-                    verification_prompt_template_content,
-                    paper_id_queue,
-                    progress_lock,
-                    processed_count,
+                    verification_prompt_template_parts,
+                    paper_queue,
+                    results_queue,
+                    processed_counter,
                     total_papers,
                     model_alias
                 )
@@ -338,10 +340,13 @@ def run_verification(mode='remaining', paper_id=None, db_file=None, grammar_file
             
             print("Verification processing started. Press Ctrl+C to abort.")
             
-            while not globals.is_shutdown_flag_set():
-                if all(f.done() for f in futures):
-                    break
-                time.sleep(0.1)
+            # Block until every worker returns. The timeout only lets the main thread run
+            # signal_handler on Ctrl+C: on Windows a blocking wait defers signals until it returns.
+            while wait(futures, timeout=1).not_done:
+                pass
+            # Workers handle per-paper errors themselves; re-raise anything that escaped one
+            for future in futures:
+                future.result()
 
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt caught in run_verification. Setting shutdown flag.")
@@ -350,11 +355,13 @@ def run_verification(mode='remaining', paper_id=None, db_file=None, grammar_file
         print(f"Error in main verification execution loop: {e}")
         globals.set_shutdown_flag()
     finally:
+        # Flush whatever the writer still holds before reporting (skipped if the writer already died)
+        if not globals.put_result(results_queue, None, db_writer):
+            print("DB writer stopped early; some results were not saved.")
+        db_writer.join()
         end_time = time.time()
-        final_count = 0
-        if progress_lock:
-            with progress_lock:
-                final_count = processed_count[0] if processed_count else 0
+        # Workers are done, so the next value is one past the number verified
+        final_count = next(processed_counter) - 1
         print(f"\n--- Verification Summary ---")
         print(f"Papers verified: {final_count}/{total_papers}")
         print(f"Time taken: {end_time - start_time:.2f} seconds")
@@ -390,5 +397,6 @@ if __name__ == "__main__":
         server_url=args.server_url
     )
 
-    if not success and not globals.is_shutdown_flag_set():
+    # Failed or aborted with Ctrl+C
+    if not success:
         exit(1)
\ No newline at end of file